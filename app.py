@@ -1,9 +1,18 @@
 import streamlit as st
-import tensorflow as tf
-import random
-from PIL import Image, ImageOps
+import html
+import os
+from PIL import Image
 import numpy as np
 import warnings
+import calibration
+import cascade
+import inference
+import metrics
+import skin_expert
+from conditions import class_names, disease_descriptions, remedies
+from prediction_cache import PredictionCache
+from preprocessing import preprocess_batch
+from similarity_index import SimilarityIndex
 warnings.filterwarnings("ignore")
 
 # Page configuration
@@ -162,102 +171,188 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Load model function
+# Version of the weights behind predictions; a cascade also depends on the
+# screener, its threshold and both temperatures, since it returns calibrated
+# probabilities
+@st.cache_resource
+def model_version():
+    version = inference.model_version()
+    if cascade.SCREENER_PATH:
+        temperatures = cascade.load_temperatures(cascade.SCREENER_PATH)
+        version += (f"+{inference.model_version(cascade.SCREENER_PATH, url=None)}@{cascade.ESCALATE_THRESHOLD}"
+                    f"/{temperatures[0]:.6g},{temperatures[1]:.6g}")
+    return version
+
+# Reference images for similar-case retrieval, from the index written by
+# similarity_index.py (DERMATRIX_SIMILAR_INDEX). None when there is no index
+# for the current model.
+@st.cache_resource
+def similar_cases_index():
+    path = os.environ.get('DERMATRIX_SIMILAR_INDEX', 'similar_cases')
+    if not os.path.exists(os.path.join(path, 'index.npz')):
+        return None
+    index = SimilarityIndex(path)
+    if index.model_version != model_version():
+        return None
+    return index
+
+similar_index = similar_cases_index()
+
+# Model loader, created once per server process. Loading and warm-up run on a
+# background thread so the tabs render while TensorFlow starts. With a
+# similar-case index the model also returns embeddings; with
+# DERMATRIX_SCREENER set it runs as a screener/full-model cascade.
+@st.cache_resource
+def model_loader():
+    return inference.ModelLoader(embeddings=similar_index is not None, screener=cascade.SCREENER_PATH)
+
+# Test split report written by cascade.py for the configured screener
 @st.cache_resource
+def cascade_report():
+    return cascade.load_report(cascade.SCREENER_PATH) if cascade.SCREENER_PATH else None
+
+loader = model_loader()
+
+# Load model function
 def load_model():
-    model = tf.keras.models.load_model('skin.h5')
+    model = loader.get()
     return model
 
-# Prediction function
-def import_and_predict(image_data, model):
-    size = (300, 300)    
-    image = ImageOps.fit(image_data, size, Image.LANCZOS)
-    img = np.asarray(image)
-    img_reshape = img[np.newaxis, ...]
-    prediction = model.predict(img_reshape)
-    return prediction
+# Prediction cache shared by all sessions, keyed by upload bytes and model
+# version. Set DERMATRIX_CACHE_DB to also share it between app processes.
+@st.cache_resource
+def prediction_cache():
+    return PredictionCache(
+        max_entries=int(os.environ.get('DERMATRIX_CACHE_SIZE', 1024)),
+        path=os.environ.get('DERMATRIX_CACHE_DB')
+    )
+
+# Softmax temperature fitted on the validation split (1.0 if uncalibrated).
+# A local cascade calibrates each row with its own model's temperature, so
+# its output is not scaled again.
+@st.cache_resource
+def temperature():
+    if loader.screener:
+        return 1.0
+    return calibration.load_temperature()
+
+# Stage latencies shared by all sessions. DERMATRIX_METRICS_PORT serves them
+# in Prometheus format, DERMATRIX_METRICS_LOG logs every request as JSON.
+@st.cache_resource
+def latency_metrics():
+    registry = metrics.Metrics(log_path=metrics.METRICS_LOG)
+    if metrics.METRICS_PORT:
+        metrics.serve(registry, metrics.METRICS_PORT)
+    return registry
 
-# Class names
-class_names = [
-    'Eczema',
-    'Warts Molluscum and other Viral Infections',
-    'Melanoma',
-    'Atopic Dermatitis',
-    'Basal Cell Carcinoma (BCC)',
-    'Melanocytic Nevi (NV)',
-    'Benign Keratosis-like Lesions (BKL)',
-    'Psoriasis pictures Lichen Planus and related diseases',
-    'Seborrheic Keratoses and other Benign Tumors',
-    'Tinea Ringworm Candidiasis and other Fungal Infections'
-]
+# Retrieval index over the condition texts for the Skin Expert chat
+@st.cache_resource
+def expert_index():
+    return skin_expert.BM25Index(skin_expert.passages())
 
-# Disease descriptions for About tab
-disease_descriptions = {
-    'Eczema': "A condition that causes the skin to become itchy, red, dry and cracked. It's common in children but can occur at any age.",
-    'Warts Molluscum and other Viral Infections': "Viral skin infections characterized by small, raised bumps on the skin. Contagious and spread through direct contact.",
-    'Melanoma': "The most serious type of skin cancer that develops from the pigment-producing cells known as melanocytes.",
-    'Atopic Dermatitis': "A chronic, inflammatory skin disease associated with asthma and hay fever, commonly starting in childhood.",
-    'Basal Cell Carcinoma (BCC)': "The most common form of skin cancer, usually caused by sun exposure.",
-    'Melanocytic Nevi (NV)': "Common moles that appear as small, dark brown spots caused by clusters of pigmented cells.",
-    'Benign Keratosis-like Lesions (BKL)': "Non-cancerous growths that appear as waxy, scaly, slightly raised growths on the skin.",
-    'Psoriasis pictures Lichen Planus and related diseases': "Inflammatory skin conditions characterized by scaly, itchy patches or bumps.",
-    'Seborrheic Keratoses and other Benign Tumors': "Common non-cancerous skin growths that begin in keratinocytes and appear as waxy, scaly patches.",
-    'Tinea Ringworm Candidiasis and other Fungal Infections': "Fungal infections on the skin characterized by ring-shaped rashes. Highly contagious."
-}
+# Chat history is trimmed to the greeting and this many recent messages
+MAX_CHAT_MESSAGES = 20
 
-# Remedies for diseases
-remedies = {
-    'Eczema': {
-        'primary': 'An effective, intensive treatment for severe eczema involves applying a corticosteroid ointment and sealing in the medication with a wrap of wet gauze topped with a layer of dry gauze.',
-        'secondary': "DUPIXENT® (dupilumab) is a prescription medicine used to treat people aged 6 years and older with moderate-to-severe atopic dermatitis (eczema) that is not well controlled with prescription therapies used on the skin (topical) or who cannot use topical therapies. Other treatments for eczema include azathioprine, cyclosporine, methotrexate, pimecrolimus, crisaborole, and tacrolimus, which are prescription creams and ointments that control inflammation and reduce immune system reactions. Calcineurin inhibitors, such as pimecrolimus and tacrolimus, are also recommended if OTC steroids don't work or cause problems. Corticosteroid creams, solutions, gels, foams, and ointments, made with hydrocortisone steroids, can quickly relieve itching and reduce inflammation. Pimecrolimus cream or tacrolimus ointment, also known as topical calcineurin inhibitors (TCIs), may be prescribed by a dermatologist.",
-        'contagious': False
-    },
-    'Melanoma': {
-        'primary': "Treatment for early-stage melanomas usually includes surgery to remove the melanoma. A very thin melanoma may be removed entirely during the biopsy and require no further treatment. Otherwise, your surgeon will remove the cancer as well as a border of normal skin and a layer of tissue beneath the skin.",
-        'secondary': "Ipilimumab (Yervoy®) is an immunotherapy drug used to treat metastatic melanoma and stage III melanoma that cannot be removed completely with surgery. It works by blocking an immune molecule called CTLA-4. Checkpoint inhibitors, also known as immune checkpoint blockade, are commonly used to treat melanoma. Interferon alfa (Intron A, Roferon-A) can be used after surgery to prevent melanoma recurrence. Targeted therapy of melanoma includes vemurafenib, cobimetinib, dabrafenib, and trametinib, which attack cells that have a damaged BRAF gene. Targeted medicines for melanoma with NRAS and C-KIT mutations may be available through clinical trials.",
-        'contagious': False
-    },
-    'Atopic Dermatitis': {
-        'primary': "The main treatments for atopic eczema are: emollients (moisturisers) used every day to stop the skin becoming dry. topical corticosteroids creams and ointments used to reduce swelling and redness during flare-ups.",
-        'secondary': "DUPIXENT® (dupilumab) is a prescription medicine used to treat moderate-to-severe atopic dermatitis (eczema) that is not well controlled with prescription therapies used on the skin (topical), or who cannot use topical therapies. It is not known if DUPIXENT is safe and effective in children with atopic dermatitis under 6 years of age. Cibinqo (abrocitinib) is an oral JAK1 inhibitor approved by the FDA for adults with refractory moderate to severe atopic dermatitis whose disease is not adequately controlled with other systemic drug products, including biologics, or when use of those therapies is inadvisable. Immunosuppressants are prescribed for moderate to severe atopic dermatitis in children and adults to help stop the itch-scratch cycle of eczema, to allow the skin to heal and reduce the risk of skin infection. Topical calcineurin inhibitors, immunosuppressant tablets, and alitretinoin are some of the topical treatments for atopic dermatitis.",
-        'contagious': False
-    },
-    'Basal Cell Carcinoma (BCC)': {
-        'primary': "The current mainstay of BCC treatment involves surgical modalities such as excision, electrodesiccation and curettage (EDC), cryosurgery, and Mohs micrographic surgery. Such methods are typically reserved for localized BCC and offer high 5-year cure rates, generally over 95%.",
-        'secondary': "Basal cell skin cancer does not usually respond to chemotherapy, but it often responds to a targeted drug called vismodegib, sold as Erivedge®, which helps disrupt the activity of a group of proteins in the body called hedgehog. Erivedge® (vismodegib) capsule is a prescription medicine used to treat adults with basal cell carcinoma that has spread to other parts of the body or that has come back after surgery or that cannot be treated with surgery or radiation. It is the #1 most-prescribed oral medication for advanced basal cell carcinoma.",
-        'contagious': False
-    },
-    'Melanocytic Nevi (NV)': {
-        'primary': "Small nevi can be removed by simple surgical excision. The nevus is cut out, and the adjacent skin stitched together leaving a small scar. Removal of a large congenital nevus, however, requires replacement of the affected skin.",
-        'secondary': "Melanocytic nevus is the medical term for a mole. Nevi can appear anywhere on the body. They are benign (non-cancerous) and typically do not require treatment. A very small percentage of melanocytic nevi may develop a melanoma within them. Of note, the majority of cutaneous melanomas arise within normally appearing skin.",
-        'contagious': False
-    },
-    'Benign Keratosis-like Lesions (BKL)': {
-        'primary': "Cryosurgery: The dermatologist applies liquid nitrogen, a very cold liquid, to the growth with a cotton swab or spray gun. Electrosurgery and curettage: Electrosurgery (electrocautery) involves numbing the growth with an anesthetic and using an electric current to destroy the growth.",
-        'secondary': "A seborrheic keratosis is a growth on the skin. The growth is not cancer (benign). It's color can range from white, tan, brown, or black. Seborrheic keratoses often appear on a person's chest, arms, back, or other areas. They're very common in people older than age 50.",
-        'contagious': False
-    },
-    'Psoriasis pictures Lichen Planus and related diseases': {
-        'primary': "Lichen planus does not usually require treatment. It often goes away by itself within a year. If a person has particularly itchy or painful outbreaks, a doctor may prescribe topical corticosteroids or light therapy. Psoriasis is a long-term condition, but people can usually manage their symptoms well.",
-        'secondary': "There isn't a cure for lichen planus. If you have lichen planus on your skin, in most cases, it goes away without treatment in as little as a few months to several years. Corticosteroid creams or ointments. Your healthcare provider may prescribe corticosteroid creams or ointments to reduce inflammation. Phototherapy uses ultraviolet light, usually ultraviolet B (UVB), from special lamps. The ultraviolet light waves found in sunlight can help certain skin disorders, including lichen planus.",
-        'contagious': False
-    },
-    'Seborrheic Keratoses and other Benign Tumors': {
-        'primary': "Eskata, a 40% hydrogen peroxide topical solution, is the first FDA-approved drug for treatment of seborrheic keratoses. Administration of the drug may be tedious and usually requires at least two office visits.",
-        'secondary': "Ammonium lactate and alpha hydroxy acids have been reported to reduce the height of seborrheic keratoses, and superficial lesions can be treated by carefully applying pure trichloroacetic acid and repeating if the full thickness is not removed on the first treatment. Topical treatment with tazarotene cream 0.1% applied twice daily for 16 weeks caused clinical improvement in seborrheic keratoses in 7 of 15 patients. Diclofenac gel may be a new treatment option for seborrheic keratosis. Hydrogen peroxide 40% (Eskata) is a topical solution for the in-office treatment of raised seborrheic keratosis lesions.",
-        'contagious': False
-    },
-    'Tinea Ringworm Candidiasis and other Fungal Infections': {
-        'primary': "Typically, a course of antifungal creams (either prescription or over-the-counter) will clear up the rash and relieve the itchiness. Your healthcare provider can also discuss preventive steps to keep the rash from coming back.",
-        'secondary': "Tinea ringworm can be treated with over-the-counter (OTC) antifungal creams containing clotrimazole, ketoconazole, econazole, tolnaftate, or terbinafine. However, if there are many patchy areas, a prescription cream or oral antifungal medicine taken by mouth may be necessary.",
-        'contagious': True
-    },
-    'Warts Molluscum and other Viral Infections': {
-        'primary': "Doctors recommend many topical treatments for molluscum contagiosum. Podophyllotoxin (contraindicated in pregnant women), potassium hydroxide, salicylic acid (associated or not with povidone-iodine), benzoyl peroxide, and tretinoin are used as home treatments and must be applied to each lesion.",
-        'secondary': "Cantharidin (beetle juice): This FDA-approved treatment is made from blister beetles. It's approved to treat adults and children two years of age and older. Dermatologists have been using cantharidin to treat warts and molluscum since the 1950s. When treating molluscum bumps, your dermatologist applies the beetle juice to each bump. Your dermatologist will apply it to each bump in such a way that a water blister later forms.",
-        'contagious': True
-    }
-}
+# How often the sidebar's status lines refresh
+STATUS_REFRESH_SECONDS = 5
+
+cache = prediction_cache()
+latency = latency_metrics()
+
+# Prediction function. Uploads already scored by this model version come
+# from the cache; the rest go through the model in one batch. Each stage is
+# timed into trace. Returns calibrated probabilities and, with embeddings
+# set and a model that provides them, each upload's embedding (else None).
+# A cache entry holds the probabilities followed by the embedding when one
+# was computed, so an upload takes one lookup and one slot either way.
+def import_and_predict(files, trace, embeddings=False):
+    embeddings = embeddings and loader.embeddings
+    classes = len(class_names)
+    with trace.stage('read'):
+        data = [f.getvalue() for f in files]
+    with trace.stage('cache_lookup'):
+        keys = [cache.key(d, model_version()) for d in data]
+        entries = [cache.get(key) for key in keys]
+    missing = [i for i, e in enumerate(entries) if e is None or (embeddings and len(e) == classes)]
+    # an image uploaded more than once is scored once, from its first copy
+    unique = sorted({keys[i]: i for i in reversed(missing)}.values())
+    if missing:
+        with trace.stage('model_wait'), st.spinner('Loading model...'):
+            model = load_model()
+        with trace.stage('open'):
+            images = [Image.open(files[i]) for i in unique]
+        # decode, crop/resize and conversion to a uint8 array
+        with trace.stage('preprocess'):
+            batch = preprocess_batch(images)
+        with trace.stage('predict'):
+            if embeddings:
+                scored, embedded = inference.run_model_with_embeddings(batch, model)
+            else:
+                scored, embedded = inference.run_model(batch, model), [None] * len(unique)
+        fresh = {}
+        for i, p, e in zip(unique, scored, embedded):
+            fresh[keys[i]] = np.asarray(p, dtype=np.float32) if e is None else np.concatenate([p, e]).astype(np.float32)
+            cache.put(keys[i], fresh[keys[i]])
+        for i in missing:
+            entries[i] = fresh[keys[i]]
+    predictions = np.stack([e[:classes] for e in entries])
+    vectors = [e[classes:] if embeddings else None for e in entries]
+    with trace.stage('calibrate'):
+        return calibration.apply_temperature(predictions, temperature()), vectors
+
+# import_and_predict for the current uploads, remembered in session state
+# under their upload ids so reruns with the same uploads skip it entirely.
+# Such replays are traced as detection_replay instead of detection.
+def detect(files, trace, embeddings=False):
+    key = (tuple(f.file_id for f in files), embeddings)
+    stored = st.session_state.get("detection")
+    if stored is not None and stored[0] == key:
+        trace.name = 'detection_replay'
+        return stored[1]
+    result = import_and_predict(files, trace, embeddings)
+    st.session_state.detection = (key, result)
+    return result
+
+# Record a Detection request. A replay is recorded under its own name only,
+# without a render sample, so reruns that never reached the cache or the model
+# stay out of the detection and render histograms.
+def finish_detection(trace, **fields):
+    trace.finish(remainder='render' if trace.name == 'detection' else None, **fields)
+
+# The About tab's grid of conditions as one HTML block, built once
+@st.cache_resource
+def conditions_grid_html():
+    boxes = []
+    for name in class_names:
+        contagious = "<p style='color:#ffd166'>⚠️ This condition is contagious</p>" if remedies[name]['contagious'] else ""
+        boxes.append(f"<div class='disease-box'><h3>{html.escape(name)}</h3>"
+                     f"<p>{html.escape(disease_descriptions[name])}</p>{contagious}</div>")
+    return f"<div class='grid-container'>{''.join(boxes)}</div>"
+
+# Model status, cache counters, cascade and latency lines. A fragment on a
+# timer, so they keep up with detections that only rerun the Detection tab.
+@st.experimental_fragment(run_every=STATUS_REFRESH_SECONDS)
+def sidebar_status():
+    if loader.ready.is_set() and loader.error is None:
+        st.metric("Model startup time", f"{loader.startup_seconds:.1f} s")
+    elif not loader.ready.is_set():
+        st.caption("Model is loading in the background...")
+    
+    stats = cache.stats()
+    st.caption(f"Prediction cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions")
+    
+    if isinstance(loader.model, cascade.CascadeModel):
+        screened = loader.model.stats()
+        saved = f", ~{screened['compute_saved'] * 100:.0f}% compute saved" if screened['compute_saved'] is not None else ""
+        st.caption(f"Cascade: {screened['escalation_rate'] * 100:.0f}% of {screened['images']} images escalated to the full model{saved}")
+        report = cascade_report()
+        if report:
+            st.caption(f"Cascade on the test split: {report['agreement'] * 100:.1f}% agreement with the full model, "
+                       f"{report['escalation_rate'] * 100:.0f}% escalated, {report['compute_saved'] * 100:.0f}% compute saved")
+    
+    detection = latency.snapshot().get('detection')
+    if detection:
+        st.caption(f"Detection latency: p50 {detection['p50_ms']:.0f} ms, p95 {detection['p95_ms']:.0f} ms, p99 {detection['p99_ms']:.0f} ms")
 
 # Sidebar content
 with st.sidebar:
@@ -268,51 +363,99 @@ with st.sidebar:
     st.markdown("---")
     st.markdown("### About the Model")
     st.info("This AI-powered tool helps identify common skin conditions. Always consult with a healthcare professional for accurate diagnosis and treatment.")
+    
+    sidebar_status()
 
 # Main content
 tabs = st.tabs(["🔍 Detection", "ℹ️ About", "💬 Skin Expert"])
 
-# Detection Tab
-with tabs[0]:
+# Detection Tab. Each tab is a fragment, so a widget in one tab reruns only
+# that tab.
+@st.experimental_fragment
+def detection_tab():
     st.markdown("## Skin Disease Detection")
     
     st.markdown('<div class="custom-box">', unsafe_allow_html=True)
     st.markdown("### Upload an image of your skin condition")
     st.markdown("The AI will analyze the image and provide possible diagnosis and treatment suggestions.")
-    file = st.file_uploader("", type=["jpg", "png"])
+    batch_mode = st.toggle("Analyze multiple images at once")
+    if batch_mode:
+        files = st.file_uploader("", type=["jpg", "png"], accept_multiple_files=True, key="batch_upload")
+        file = None
+    else:
+        files = []
+        file = st.file_uploader("", type=["jpg", "png"], key="single_upload")
     st.markdown('</div>', unsafe_allow_html=True)
     
-    if file is not None:
+    # Timing of this request; time outside the prediction stages is rendering
+    trace = metrics.Trace(latency, 'detection')
+    
+    if files:
         try:
-            # Load model if it's not already loaded
-            with st.spinner('Loading model...'):
-                model = load_model()
-                
-            # Process image
-            image = Image.open(file)
+            # Score all uploads in batched forward passes
+            with st.spinner(f'Analyzing {len(files)} images...'):
+                predictions, _ = detect(files, trace)
+            
+            st.markdown("### Analysis Results")
+            st.dataframe(
+                inference.prediction_table([f.name for f in files], predictions, calibration.REFER_THRESHOLD),
+                use_container_width=True,
+                hide_index=True,
+                column_config={"Probability": st.column_config.ProgressColumn("Probability", min_value=0.0, max_value=1.0, format="%.2f")}
+            )
+            
+            st.markdown("---")
+            st.warning("⚠️ For accurate assessment of disease severity, please consult a dermatologist for in-person examination.")
+            finish_detection(trace, images=len(files))
             
+        except Exception as e:
+            st.error(f"Error processing images: {e}")
+            finish_detection(trace, images=len(files), error=type(e).__name__)
+    elif file is not None:
+        try:
             # Display image and prediction
             col1, col2 = st.columns([1, 1])
             
             with col1:
                 st.markdown("### Uploaded Image")
-                st.image(image, use_column_width=True)
+                st.image(file.getvalue(), use_column_width=True)
             
             with col2:
                 st.markdown("### Analysis Results")
                 
                 # Make prediction
-                predictions = import_and_predict(image, model)
-                predicted_class = class_names[np.argmax(predictions)]
+                predictions, embeddings = detect([file], trace, embeddings=True)
+                top_index, top_probability = calibration.top_k(predictions[0], k=3)
+                predicted_class = class_names[top_index[0]]
+                st.session_state.last_prediction = predicted_class
                 
-                # Generate confidence score
-                confidence = random.randint(88, 99) + random.randint(0, 99) * 0.01
+                # Confidence is the calibrated probability of the top class
+                confidence = top_probability[0] * 100
                 
                 # Display prediction and confidence
                 st.markdown(f"<div class='result-container'>", unsafe_allow_html=True)
                 st.markdown(f"#### Detected Condition:")
                 st.markdown(f"<h3 style='color:#8ab4f8'>{predicted_class}</h3>", unsafe_allow_html=True)
-                st.markdown(f"<p><b>Confidence:</b> {confidence}%</p>", unsafe_allow_html=True)
+                st.markdown(f"<p><b>Confidence:</b> {confidence:.2f}%</p>", unsafe_allow_html=True)
+                
+                # Other likely conditions
+                for index, probability in zip(top_index[1:], top_probability[1:]):
+                    st.markdown(f"{class_names[index]}: {probability * 100:.2f}%")
+                
+                if top_probability[0] < calibration.REFER_THRESHOLD:
+                    st.warning("⚠️ The model is uncertain about this image. Please refer to a dermatologist.")
+                
+                # Labelled reference images that look most like the upload
+                if embeddings[0] is not None:
+                    with trace.stage('similar'):
+                        similar = similar_index.search(embeddings[0], k=4)
+                    st.markdown("#### Similar Reference Cases")
+                    found = [(path, f"{label} ({score:.2f})") for path, label, score in similar if os.path.exists(path)]
+                    if found:
+                        st.image([path for path, _ in found], caption=[caption for _, caption in found], width=110)
+                    else:
+                        for _, label, score in similar:
+                            st.markdown(f"{label}: similarity {score:.2f}")
                 
                 # Display contagious warning if applicable
                 if remedies[predicted_class]['contagious']:
@@ -342,9 +485,11 @@ with tabs[0]:
             # Disclaimer
             st.markdown("---")
             st.warning("⚠️ For accurate assessment of disease severity, please consult a dermatologist for in-person examination.")
+            finish_detection(trace, images=1)
             
         except Exception as e:
             st.error(f"Error processing image: {e}")
+            finish_detection(trace, images=1, error=type(e).__name__)
     else:
         # Show placeholder when no image is uploaded
         st.markdown("<div class='placeholder-box'>", unsafe_allow_html=True)
@@ -352,8 +497,12 @@ with tabs[0]:
         st.markdown("Please upload a clear image of the skin condition for analysis")
         st.markdown("</div>", unsafe_allow_html=True)
 
+with tabs[0]:
+    detection_tab()
+
 # About Tab
-with tabs[1]:
+@st.experimental_fragment
+def about_tab():
     st.markdown("## About Dermatrix")
     
     st.markdown('<div class="custom-box">', unsafe_allow_html=True)
@@ -373,34 +522,19 @@ with tabs[1]:
     
     st.markdown("## Skin Conditions We Detect")
     
-    # Create a grid layout for the diseases
-    for i in range(0, len(class_names), 2):
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            if i < len(class_names):
-                st.markdown(f"<div class='disease-box'>", unsafe_allow_html=True)
-                st.markdown(f"### {class_names[i]}")
-                st.markdown(disease_descriptions[class_names[i]])
-                if remedies[class_names[i]]['contagious']:
-                    st.warning("⚠️ This condition is contagious")
-                st.markdown("</div>", unsafe_allow_html=True)
-        
-        with col2:
-            if i + 1 < len(class_names):
-                st.markdown(f"<div class='disease-box'>", unsafe_allow_html=True)
-                st.markdown(f"### {class_names[i+1]}")
-                st.markdown(disease_descriptions[class_names[i+1]])
-                if remedies[class_names[i+1]]['contagious']:
-                    st.warning("⚠️ This condition is contagious")
-                st.markdown("</div>", unsafe_allow_html=True)
+    # Grid layout for the diseases, rendered once per server process
+    st.markdown(conditions_grid_html(), unsafe_allow_html=True)
     
     st.markdown("---")
     st.markdown("### Disclaimer")
     st.warning("This application is intended for informational purposes only and is not a substitute for professional medical advice, diagnosis, or treatment. Always seek the advice of your physician or other qualified health provider with any questions you may have regarding a medical condition.")
 
+with tabs[1]:
+    about_tab()
+
 # Skin Expert Tab (Chatbot)
-with tabs[2]:
+@st.experimental_fragment
+def expert_tab():
     st.markdown("## Skin Expert Chatbot")
     
     st.markdown('<div class="custom-box">', unsafe_allow_html=True)
@@ -417,6 +551,9 @@ with tabs[2]:
             {"role": "assistant", "content": "Hello! I'm your Skin Health Assistant. How can I help you with your skin health questions today?"}
         ]
     
+    if "last_prediction" in st.session_state:
+        st.caption(f"Answers take your last detection, {st.session_state.last_prediction}, into account.")
+    
     # Display chat messages
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
@@ -431,16 +568,21 @@ with tabs[2]:
         with st.chat_message("user"):
             st.markdown(prompt)
         
-        # Generate a response (placeholder for actual AI logic)
-        response = "I'm a simple demo chatbot. In the full version, I would analyze your question and provide information about skin conditions, treatments, and preventive measures. For now, please try the Detection tab to analyze skin images or check the About tab for information on common skin conditions."
+        # Answer from the condition texts, with the last detection as context
+        response = skin_expert.answer(expert_index(), prompt, st.session_state.get("last_prediction"))
         
-        # Display assistant response
+        # Stream the assistant response
         with st.chat_message("assistant"):
-            st.markdown(response)
+            st.write_stream(skin_expert.stream(response))
         
-        # Add assistant response to chat history
+        # Add assistant response to chat history, keeping it bounded
         st.session_state.messages.append({"role": "assistant", "content": response})
+        if len(st.session_state.messages) > MAX_CHAT_MESSAGES + 1:
+            st.session_state.messages = st.session_state.messages[:1] + st.session_state.messages[-MAX_CHAT_MESSAGES:]
     
     # Disclaimer at the bottom of the chat
     st.markdown("---")
     st.info("This chatbot provides general information only. For specific medical advice, please consult a healthcare professional.")
+
+with tabs[2]:
+    expert_tab()
@@ -0,0 +1,191 @@
+# Offline batch scoring for regression runs over held-out image folders.
+#
+# Images are decoded and resized on a process pool and streamed to the model
+# in fixed-size batches. Per-image probabilities go to a Parquet file; for
+# images in sub-folders named after the model's classes (conditions.py or
+# --class-csv), the confusion matrix, per-class precision/recall and the
+# misclassified files are computed with NumPy and written next to it as JSON.
+# Throughput and peak RSS are reported per run.
+#
+#   python batch_scorer.py held_out/ --model skin.h5 --output scores.parquet
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import resource
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import inference
+from conditions import class_names
+from preprocessing import IMAGE_SIZE, preprocess_batch
+
+
+# Class names in the order of the model's outputs: from a class_dict.csv
+# written by the notebook's saver(), else conditions.class_names
+def load_classes(class_csv=None):
+    if class_csv:
+        return list(pd.read_csv(class_csv).sort_values('class_index')['class'])
+    return list(class_names)
+
+
+# Dataset folder and class names carry a number and an image count
+# ('2. Melanoma 15.75k'), which are stripped before they are compared
+def _bare_name(name):
+    return re.sub(r'^\d+\.\s*|[\s-]*[\d.]+k?$', '', name).strip().lower()
+
+
+# Index in classes of the class a folder is named after, or -1. The bare
+# folder name must be a class's bare name or the start of exactly one of them
+# ('Warts Molluscum' for 'Warts Molluscum and other Viral Infections').
+def folder_class(folder, classes):
+    folder = _bare_name(folder)
+    if not folder:
+        return -1
+    names = [_bare_name(c) for c in classes]
+    if folder in names:
+        return names.index(folder)
+    matches = [i for i, name in enumerate(names) if name.startswith(folder + ' ')]
+    return matches[0] if len(matches) == 1 else -1
+
+
+# Paths below directories and their class indices (-1 when the parent folder
+# is not a known class)
+def list_inputs(directories, classes):
+    paths = []
+    for directory in directories:
+        paths.extend(inference.list_images(directory))
+    folders = {os.path.basename(os.path.dirname(p)) for p in paths}
+    class_index = {folder: folder_class(folder, classes) for folder in folders}
+    labels = np.array([class_index[os.path.basename(os.path.dirname(p))] for p in paths], dtype=np.int64)
+    return paths, labels
+
+
+def _load_chunk(paths, image_size, crop):
+    return preprocess_batch(paths, image_size, workers=1, crop=crop)
+
+
+# Model probabilities for paths. Chunks of batch_size images are decoded on
+# workers processes with at most 2 * workers chunks in flight, and each chunk
+# is sent through the model as it arrives, in order. Workers are spawned
+# rather than forked so they never inherit TensorFlow's threads.
+def score(paths, model, batch_size=32, workers=None, image_size=IMAGE_SIZE, crop=False):
+    workers = workers or os.cpu_count()
+    chunks = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    outputs = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_load_chunk, chunk, image_size, crop))
+            if len(pending) >= 2 * workers:
+                outputs.append(np.asarray(model.predict_on_batch(pending.popleft().result())))
+        while pending:
+            outputs.append(np.asarray(model.predict_on_batch(pending.popleft().result())))
+    if not outputs:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.concatenate(outputs)
+
+
+# Confusion matrix, per-class precision/recall and misclassified rows for
+# integer labels and an (n, classes) probability array
+def evaluate(labels, probabilities, classes):
+    labels = np.asarray(labels)
+    predicted = probabilities.argmax(axis=1)
+    k = len(classes)
+    confusion = np.bincount(labels * k + predicted, minlength=k * k).reshape(k, k)
+    correct = np.diag(confusion)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(confusion.sum(axis=0) > 0, correct / confusion.sum(axis=0), 0.0)
+        recall = np.where(confusion.sum(axis=1) > 0, correct / confusion.sum(axis=1), 0.0)
+    errors = np.flatnonzero(predicted != labels)
+    return {
+        'accuracy': float(correct.sum() / max(len(labels), 1)),
+        'confusion_matrix': confusion,
+        'precision': precision,
+        'recall': recall,
+        'errors': errors,
+        'predicted': predicted,
+    }
+
+
+# Peak resident set size in MB of this process and of its (finished) workers
+def peak_rss_mb():
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return own, children
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score image folders with the skin disease model')
+    parser.add_argument('inputs', nargs='+', help='image folders; sub-folders named after classes give ground truth')
+    parser.add_argument('--model', default=inference.MODEL_PATH)
+    parser.add_argument('--class-csv', help="class_dict.csv from the notebook's saver()")
+    parser.add_argument('--output', default='scores.parquet')
+    parser.add_argument('--batch-size', type=int, default=inference.BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--crop', action='store_true', help='centre-crop like the app instead of resizing the whole image')
+    parser.add_argument('--show-errors', type=int, default=20)
+    args = parser.parse_args()
+
+    classes = load_classes(args.class_csv)
+    paths, labels = list_inputs(args.inputs, classes)
+    if not paths:
+        parser.error(f"no images found in {', '.join(args.inputs)}")
+    model = inference.load_model(args.model, url=None)
+
+    start = time.perf_counter()
+    probabilities = score(paths, model, args.batch_size, args.workers, crop=args.crop)
+    elapsed = time.perf_counter() - start
+    if probabilities.shape[1] != len(classes):
+        parser.error(f'the model has {probabilities.shape[1]} outputs but there are {len(classes)} classes; '
+                     'pass the matching --class-csv')
+
+    frame = pd.DataFrame(probabilities, columns=classes)
+    frame.insert(0, 'path', paths)
+    frame.insert(1, 'label', [classes[i] if i >= 0 else None for i in labels])
+    frame.insert(2, 'predicted', [classes[i] for i in probabilities.argmax(axis=1)])
+    frame.insert(3, 'probability', probabilities.max(axis=1))
+    frame.to_parquet(args.output, index=False)
+
+    own_rss, worker_rss = peak_rss_mb()
+    print(f'{len(paths)} images in {elapsed:.1f} s: {len(paths) / elapsed:.1f} images/s')
+    print(f'peak RSS: {own_rss:.0f} MB (scorer), {worker_rss:.0f} MB (largest decode worker)')
+    print(f'probabilities written to {args.output}')
+
+    known = labels >= 0
+    if not known.any():
+        return
+    report = evaluate(labels[known], probabilities[known], classes)
+    errors = np.flatnonzero(known)[report['errors']]
+    print(f"accuracy on {known.sum()} labelled images: {report['accuracy'] * 100:.2f} %")
+    print(f"{'class':60s}{'precision':>10s}{'recall':>10s}")
+    for name, p, r in zip(classes, report['precision'], report['recall']):
+        print(f'{name[:58]:60s}{p:10.3f}{r:10.3f}')
+    for i in errors[:args.show_errors]:
+        print(f"{paths[i]}  predicted {frame['predicted'][i]} ({frame['probability'][i]:.3f}), true {frame['label'][i]}")
+
+    metrics_path = os.path.splitext(args.output)[0] + '.metrics.json'
+    with open(metrics_path, 'w') as f:
+        json.dump({
+            'images': len(paths),
+            'seconds': elapsed,
+            'images_per_second': len(paths) / elapsed,
+            'peak_rss_mb': own_rss,
+            'peak_worker_rss_mb': worker_rss,
+            'accuracy': report['accuracy'],
+            'classes': classes,
+            'confusion_matrix': report['confusion_matrix'].tolist(),
+            'precision': report['precision'].tolist(),
+            'recall': report['recall'].tolist(),
+            'misclassified': [paths[i] for i in errors],
+        }, f, indent=2)
+    print(f'metrics written to {metrics_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# Reproducible end-to-end inference benchmark.
+#
+# Replays the sample images through preprocessing and the model at every
+# combination of --batch-sizes and --concurrency, and reports throughput and
+# p50/p95/p99 request latency with the per-stage breakdown. Each request
+# decodes batch_size images from bytes already in memory, so disk speed does
+# not enter the numbers.
+#
+#   python benchmark.py --batch-sizes 1,8,32 --concurrency 1,4 --output bench.json
+#   python benchmark.py --baseline bench.json   # exit 1 on a regression
+#
+# --url benchmarks an inference_server.py worker instead of a local model.
+import argparse
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import inference
+import metrics
+from preprocessing import preprocess_batch
+
+
+# One request: preprocess and score batch_size samples starting at offset
+def run_request(model, samples, offset, batch_size, registry):
+    trace = metrics.Trace(registry, 'request')
+    images = [io.BytesIO(samples[(offset + i) % len(samples)]) for i in range(batch_size)]
+    with trace.stage('preprocess'):
+        batch = preprocess_batch(images, workers=1)
+    with trace.stage('predict'):
+        inference.run_model(batch, model, batch_size)
+    trace.finish()
+
+
+# Run requests requests of batch_size images from concurrency threads
+def run(model, samples, batch_size, concurrency, requests):
+    registry = metrics.Metrics()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda r: run_request(model, samples, r * batch_size, batch_size, registry), range(requests)))
+    elapsed = time.perf_counter() - start
+    return {
+        'batch_size': batch_size,
+        'concurrency': concurrency,
+        'requests': requests,
+        'images_per_second': requests * batch_size / elapsed,
+        'stages': registry.snapshot(),
+    }
+
+
+# Runs in current that are slower than the matching run in baseline by more
+# than tolerance, in throughput or p95 latency
+def regressions(current, baseline, tolerance):
+    previous = {(r['batch_size'], r['concurrency']): r for r in baseline['runs']}
+    found = []
+    for r in current['runs']:
+        old = previous.get((r['batch_size'], r['concurrency']))
+        if old is None:
+            continue
+        name = f"batch {r['batch_size']}, concurrency {r['concurrency']}"
+        if r['images_per_second'] < old['images_per_second'] * (1 - tolerance):
+            found.append(f"{name}: {old['images_per_second']:.1f} -> {r['images_per_second']:.1f} images/s")
+        p95, old_p95 = r['stages']['request']['p95_ms'], old['stages']['request']['p95_ms']
+        if p95 > old_p95 * (1 + tolerance):
+            found.append(f'{name}: p95 {old_p95:.1f} -> {p95:.1f} ms')
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark preprocessing and inference')
+    parser.add_argument('--images', default='Disease Images')
+    parser.add_argument('--model', default=inference.MODEL_PATH)
+    parser.add_argument('--url', default=None, help='benchmark an inference worker at this URL')
+    parser.add_argument('--batch-sizes', default='1,8,32')
+    parser.add_argument('--concurrency', default='1,4')
+    parser.add_argument('--requests', type=int, default=50, help='requests per configuration')
+    parser.add_argument('--warm-up', type=int, default=3, help='untimed requests before each configuration')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown against the baseline')
+    args = parser.parse_args()
+
+    samples = []
+    for path in inference.list_images(args.images):
+        with open(path, 'rb') as f:
+            samples.append(f.read())
+    model = inference.load_model(args.model, args.url)
+    inference.warm_up(model)
+    print(f'{len(samples)} sample images, {args.requests} requests per configuration')
+
+    results = {'model': inference.model_version(args.model, args.url), 'runs': []}
+    print(f"{'batch':>6s}{'threads':>8s}{'images/s':>10s}{'p50 ms':>9s}{'p95 ms':>9s}{'p99 ms':>9s}"
+          f"{'preprocess p95':>16s}{'predict p95':>13s}")
+    for batch_size in (int(b) for b in args.batch_sizes.split(',')):
+        for concurrency in (int(c) for c in args.concurrency.split(',')):
+            run(model, samples, batch_size, concurrency, args.warm_up)
+            r = run(model, samples, batch_size, concurrency, args.requests)
+            results['runs'].append(r)
+            request, stages = r['stages']['request'], r['stages']
+            print(f"{batch_size:6d}{concurrency:8d}{r['images_per_second']:10.1f}"
+                  f"{request['p50_ms']:9.1f}{request['p95_ms']:9.1f}{request['p99_ms']:9.1f}"
+                  f"{stages['preprocess']['p95_ms']:16.1f}{stages['predict']['p95_ms']:13.1f}", flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f'REGRESSION {line}')
+        if found:
+            sys.exit(1)
+        print(f'no regressions beyond {args.tolerance:.0%} against {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# Compare the original import_and_predict preprocessing (full decode +
+# ImageOps.fit LANCZOS) with preprocessing.py on the sample images.
+#
+#   python benchmark_preprocessing.py --megapixels 12
+#
+# --megapixels re-encodes every sample as a JPEG of roughly that size first,
+# to match phone uploads; the bundled samples are small.
+import argparse
+import io
+import time
+
+import numpy as np
+from PIL import Image, ImageOps
+
+import preprocessing
+from inference import list_images
+
+
+def original(data):
+    image = Image.open(io.BytesIO(data))
+    return np.asarray(ImageOps.fit(image, preprocessing.IMAGE_SIZE, Image.LANCZOS))
+
+
+def upscale(data, megapixels):
+    image = Image.open(io.BytesIO(data)).convert('RGB')
+    factor = (megapixels * 1e6 / (image.width * image.height)) ** 0.5
+    image = image.resize((int(image.width * factor), int(image.height * factor)), Image.BICUBIC)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+# Best-of-repeat milliseconds per image for fn over all samples
+def measure(fn, samples, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(samples)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000 / len(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark image preprocessing')
+    parser.add_argument('--images', default='Disease Images')
+    parser.add_argument('--megapixels', type=float, default=0, help='re-encode samples at this size (0 keeps them as is)')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    samples = []
+    for path in list_images(args.images):
+        with open(path, 'rb') as f:
+            data = f.read()
+        samples.append(upscale(data, args.megapixels) if args.megapixels else data)
+    print(f'{len(samples)} images, {args.repeat} repeats')
+
+    baseline = np.stack([original(d) for d in samples])
+    candidates = [
+        ('original (serial)', lambda s: [original(d) for d in s], None),
+        ('preprocessing, PIL, 1 thread', lambda s: preprocessing.preprocess_batch([io.BytesIO(d) for d in s], workers=1, use_opencv=False), False),
+        ('preprocessing, PIL', lambda s: preprocessing.preprocess_batch([io.BytesIO(d) for d in s], use_opencv=False), False),
+    ]
+    if preprocessing.cv2 is not None:
+        candidates.append(('preprocessing, OpenCV', lambda s: preprocessing.preprocess_batch([io.BytesIO(d) for d in s], use_opencv=True), True))
+
+    reference = None
+    for name, fn, use_opencv in candidates:
+        ms = measure(fn, samples, args.repeat)
+        if reference is None:
+            reference = ms
+        line = f'{name:32s}{ms:9.2f} ms/image {reference / ms:6.1f}x'
+        if use_opencv is not None:
+            batch = preprocessing.preprocess_batch([io.BytesIO(d) for d in samples], use_opencv=use_opencv)
+            line += f'   mean |diff| vs original {np.abs(batch.astype(np.int16) - baseline).mean():.2f}'
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
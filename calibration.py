@@ -0,0 +1,109 @@
+# Temperature scaling for the model's softmax output.
+#
+# The temperature is fitted offline on the validation split (see the last
+# cells of the notebook) and stored next to the model as JSON. Applying it is
+# a single vectorized step over a batch of probability vectors.
+import json
+import os
+
+import numpy as np
+
+from inference import MODEL_PATH
+
+
+# Where the temperature of the model at model_path is stored
+def calibration_path(model_path):
+    return os.path.splitext(model_path)[0] + '.calibration.json'
+
+
+CALIBRATION_PATH = calibration_path(MODEL_PATH)
+
+# Predictions whose calibrated top-1 probability is below this are shown as
+# uncertain and referred to a dermatologist
+REFER_THRESHOLD = float(os.environ.get('DERMATRIX_REFER_THRESHOLD', 0.6))
+
+
+def _log_probabilities(probabilities):
+    return np.log(np.clip(np.asarray(probabilities, dtype=np.float64), 1e-12, 1.0))
+
+
+# Rescale softmax outputs as if the logits had been divided by temperature.
+# log(p) differs from the logits only by a per-row constant, which softmax
+# ignores, so the original logits are not needed.
+def apply_temperature(probabilities, temperature):
+    logits = _log_probabilities(probabilities) / temperature
+    logits -= logits.max(axis=-1, keepdims=True)
+    scaled = np.exp(logits)
+    return (scaled / scaled.sum(axis=-1, keepdims=True)).astype(np.float32)
+
+
+def negative_log_likelihood(probabilities, labels):
+    labels = np.asarray(labels)
+    return float(-_log_probabilities(probabilities)[np.arange(len(labels)), labels].mean())
+
+
+# Mean |accuracy - confidence| over equal-width confidence bins
+def expected_calibration_error(probabilities, labels, bins=15):
+    probabilities = np.asarray(probabilities)
+    confidence = probabilities.max(axis=1)
+    correct = probabilities.argmax(axis=1) == np.asarray(labels)
+    index = np.minimum((confidence * bins).astype(int), bins - 1)
+    counts = np.bincount(index, minlength=bins)
+    gap = np.abs(np.bincount(index, weights=correct, minlength=bins) - np.bincount(index, weights=confidence, minlength=bins))
+    return float(gap.sum() / max(counts.sum(), 1))
+
+
+# Temperature minimizing validation NLL: a log-spaced grid search followed by
+# golden-section refinement around the best grid point
+def fit_temperature(probabilities, labels, low=0.05, high=20.0):
+    def loss(log_t):
+        return negative_log_likelihood(apply_temperature(probabilities, np.exp(log_t)), labels)
+
+    grid = np.linspace(np.log(low), np.log(high), 60)
+    best = int(np.argmin([loss(t) for t in grid]))
+    a, b = grid[max(best - 1, 0)], grid[min(best + 1, len(grid) - 1)]
+    ratio = (np.sqrt(5) - 1) / 2
+    for _ in range(40):
+        c, d = b - ratio * (b - a), a + ratio * (b - a)
+        if loss(c) < loss(d):
+            b = d
+        else:
+            a = c
+    return float(np.exp((a + b) / 2))
+
+
+# Fit on validation predictions and write the temperature with a before/after
+# report next to the model
+def calibrate(probabilities, labels, path=CALIBRATION_PATH):
+    temperature = fit_temperature(probabilities, labels)
+    calibrated = apply_temperature(probabilities, temperature)
+    report = {
+        'temperature': temperature,
+        'samples': int(len(labels)),
+        'nll_before': negative_log_likelihood(probabilities, labels),
+        'nll_after': negative_log_likelihood(calibrated, labels),
+        'ece_before': expected_calibration_error(probabilities, labels),
+        'ece_after': expected_calibration_error(calibrated, labels),
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+# Stored temperature, or 1.0 (no scaling) when the model is uncalibrated
+def load_temperature(path=CALIBRATION_PATH):
+    if not os.path.exists(path):
+        return 1.0
+    with open(path) as f:
+        return float(json.load(f)['temperature'])
+
+
+# Indices and probabilities of the k most likely classes for each row,
+# most likely first
+def top_k(probabilities, k=3):
+    probabilities = np.asarray(probabilities)
+    k = min(k, probabilities.shape[-1])
+    index = np.argpartition(-probabilities, k - 1, axis=-1)[..., :k]
+    values = np.take_along_axis(probabilities, index, axis=-1)
+    order = np.argsort(-values, axis=-1)
+    return np.take_along_axis(index, order, axis=-1), np.take_along_axis(values, order, axis=-1)
@@ -0,0 +1,185 @@
+# Two-stage cascade: a small screener at low resolution answers confident
+# benign cases, and only the rest go through the full EfficientNet.
+#
+# The screener (see distill_screener.py) takes the same 300x300 uint8 batch
+# as skin.h5 and resizes it internally. An image is escalated to the full
+# model when the screener's top probability is below the threshold or its
+# top class is malignant.
+#
+#   DERMATRIX_SCREENER=screener.h5 streamlit run app.py
+#   python cascade.py --packed packed/ --screener screener.h5   # test split report
+import argparse
+import json
+import os
+import threading
+
+import numpy as np
+
+import calibration
+import inference
+from conditions import class_names
+
+SCREENER_PATH = os.environ.get('DERMATRIX_SCREENER')
+ESCALATE_THRESHOLD = float(os.environ.get('DERMATRIX_ESCALATE_THRESHOLD', 0.9))
+
+# Classes the screener is never allowed to answer on its own
+MALIGNANT = ('Melanoma', 'Basal Cell Carcinoma (BCC)')
+MALIGNANT_INDICES = np.array([class_names.index(name) for name in MALIGNANT])
+
+
+# Multiply-accumulates per image of the convolution and dense layers of a
+# Keras model, used to estimate the compute the cascade saves
+def count_macs(model):
+    import tensorflow as tf
+    total = 0
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.Model):
+            total += count_macs(layer)
+        elif isinstance(layer, tf.keras.layers.DepthwiseConv2D):
+            _, h, w, c = layer.output_shape
+            total += h * w * c * int(np.prod(layer.kernel_size))
+        elif isinstance(layer, tf.keras.layers.Conv2D):
+            _, h, w, c = layer.output_shape
+            total += h * w * c * int(np.prod(layer.kernel_size)) * layer.input_shape[-1] // layer.groups
+        elif isinstance(layer, tf.keras.layers.Dense):
+            total += layer.input_shape[-1] * layer.units
+    return total
+
+
+# Which screener predictions have to go to the full model
+def escalate(screened, threshold=ESCALATE_THRESHOLD):
+    top = np.argmax(screened, axis=1)
+    return (np.max(screened, axis=1) < threshold) | np.isin(top, MALIGNANT_INDICES)
+
+
+# Softmax temperatures of the screener and the full model, from the
+# .calibration.json files next to them (1.0 where there is none)
+def load_temperatures(screener_path, model_path=inference.MODEL_PATH):
+    return (calibration.load_temperature(calibration.calibration_path(screener_path)),
+            calibration.load_temperature(calibration.calibration_path(model_path)))
+
+
+# Exposes predict_on_batch like the other model wrappers in inference.py, so
+# it can be used anywhere a model is expected. Escalation is decided on the
+# screener's raw output; each returned row is then scaled by the temperature
+# of the model that produced it (temperatures = (screener, full)).
+class CascadeModel:
+    def __init__(self, screener, full, threshold=ESCALATE_THRESHOLD, temperatures=(1.0, 1.0)):
+        self.screener = screener
+        self.full = full
+        self.threshold = threshold
+        self.temperatures = temperatures
+        self.lock = threading.Lock()
+        self.images = 0
+        self.escalated = 0
+        self.costs = None
+        try:
+            self.costs = (count_macs(screener), count_macs(getattr(full, 'model', full)))
+        except (ImportError, AttributeError):
+            pass  # not a Keras model, so the saving is not reported
+
+    def predict_on_batch(self, batch):
+        screened = np.asarray(self.screener.predict_on_batch(batch), dtype=np.float32)
+        hard = np.flatnonzero(escalate(screened, self.threshold))
+        predictions = calibration.apply_temperature(screened, self.temperatures[0])
+        if len(hard):
+            predictions[hard] = calibration.apply_temperature(self.full.predict_on_batch(batch[hard]), self.temperatures[1])
+        with self.lock:
+            self.images += len(batch)
+            self.escalated += len(hard)
+        return predictions
+
+    # Escalation rate and the fraction of full-model compute saved so far
+    def stats(self):
+        with self.lock:
+            rate = self.escalated / self.images if self.images else 0.0
+            saved = None
+            if self.costs and self.images:
+                screener, full = self.costs
+                saved = 1 - (self.images * screener + self.escalated * full) / (self.images * full)
+            return {'images': self.images, 'escalated': self.escalated, 'escalation_rate': rate, 'compute_saved': saved}
+
+
+# Path of the test split report written next to the screener
+def report_path(screener_path):
+    return os.path.splitext(screener_path)[0] + '.cascade.json'
+
+
+def load_report(screener_path):
+    path = report_path(screener_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+# Escalation rate, compute saved, agreement with the full model and accuracy
+# of the cascade at each threshold, from both models' test split predictions
+def evaluate(screened, full, labels, costs, thresholds):
+    rows = []
+    full_top = np.argmax(full, axis=1)
+    for threshold in thresholds:
+        escalated = escalate(screened, threshold)
+        cascade = np.where(escalated[:, None], full, screened)
+        rate = float(escalated.mean())
+        rows.append({
+            'threshold': float(threshold),
+            'escalation_rate': rate,
+            'compute_saved': 1 - (costs[0] + rate * costs[1]) / costs[1],
+            'agreement': float(np.mean(np.argmax(cascade, axis=1) == full_top)),
+            'accuracy': float(np.mean(np.argmax(cascade, axis=1) == labels)),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate the screener cascade on the test split')
+    parser.add_argument('source', nargs='?', help='held-out directory with one folder per class')
+    parser.add_argument('--packed', help='packed_dataset.py store whose test split is used instead')
+    parser.add_argument('--model', default=inference.MODEL_PATH)
+    parser.add_argument('--screener', default=SCREENER_PATH or 'screener.h5')
+    parser.add_argument('--threshold', type=float, default=ESCALATE_THRESHOLD)
+    parser.add_argument('--batch-size', type=int, default=inference.BATCH_SIZE)
+    args = parser.parse_args()
+    if not args.source and not args.packed:
+        parser.error('give a source directory or --packed')
+
+    if args.packed:
+        from packed_dataset import PackedDataset
+        split = PackedDataset(args.packed).split('test')
+        batch, labels = split.slice(0, len(split)), split.labels
+    else:
+        from batch_scorer import list_inputs, load_classes
+        from preprocessing import preprocess_batch
+        paths, labels = list_inputs([args.source], load_classes())
+        batch = preprocess_batch(paths, crop=False)
+
+    full = inference.load_model(args.model, url=None)
+    screener = inference.load_model(args.screener, url=None)
+    costs = (count_macs(screener), count_macs(full))
+    full_predictions = inference.run_model(batch, full, args.batch_size)
+    screened = inference.run_model(batch, screener, args.batch_size)
+
+    thresholds = sorted(set(np.round(np.arange(0.5, 1.0, 0.05), 2)) | {args.threshold})
+    rows = evaluate(screened, full_predictions, labels, costs, thresholds)
+    print(f'{len(labels)} test images, screener {costs[0] / 1e6:.0f} MMACs, full model {costs[1] / 1e6:.0f} MMACs')
+    print(f"{'threshold':>10s}{'escalated':>11s}{'saved':>8s}{'agreement':>11s}{'accuracy':>10s}")
+    for r in rows:
+        print(f"{r['threshold']:10.2f}{r['escalation_rate'] * 100:10.1f}%{r['compute_saved'] * 100:7.1f}%"
+              f"{r['agreement'] * 100:10.2f}%{r['accuracy'] * 100:9.2f}%")
+
+    chosen = next(r for r in rows if r['threshold'] == args.threshold)
+    report = {
+        **chosen,
+        'images': int(len(labels)),
+        'full_accuracy': float(np.mean(np.argmax(full_predictions, axis=1) == labels)),
+        'screener_macs': int(costs[0]),
+        'full_macs': int(costs[1]),
+    }
+    with open(report_path(args.screener), 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'report for threshold {args.threshold} written to {report_path(args.screener)}')
+
+
+if __name__ == '__main__':
+    main()
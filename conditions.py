@@ -0,0 +1,81 @@
+# Class names, in the order of the model's output units
+class_names = [
+    'Eczema',
+    'Warts Molluscum and other Viral Infections',
+    'Melanoma',
+    'Atopic Dermatitis',
+    'Basal Cell Carcinoma (BCC)',
+    'Melanocytic Nevi (NV)',
+    'Benign Keratosis-like Lesions (BKL)',
+    'Psoriasis pictures Lichen Planus and related diseases',
+    'Seborrheic Keratoses and other Benign Tumors',
+    'Tinea Ringworm Candidiasis and other Fungal Infections'
+]
+
+# Short description of each condition
+disease_descriptions = {
+    'Eczema': "A condition that causes the skin to become itchy, red, dry and cracked. It's common in children but can occur at any age.",
+    'Warts Molluscum and other Viral Infections': "Viral skin infections characterized by small, raised bumps on the skin. Contagious and spread through direct contact.",
+    'Melanoma': "The most serious type of skin cancer that develops from the pigment-producing cells known as melanocytes.",
+    'Atopic Dermatitis': "A chronic, inflammatory skin disease associated with asthma and hay fever, commonly starting in childhood.",
+    'Basal Cell Carcinoma (BCC)': "The most common form of skin cancer, usually caused by sun exposure.",
+    'Melanocytic Nevi (NV)': "Common moles that appear as small, dark brown spots caused by clusters of pigmented cells.",
+    'Benign Keratosis-like Lesions (BKL)': "Non-cancerous growths that appear as waxy, scaly, slightly raised growths on the skin.",
+    'Psoriasis pictures Lichen Planus and related diseases': "Inflammatory skin conditions characterized by scaly, itchy patches or bumps.",
+    'Seborrheic Keratoses and other Benign Tumors': "Common non-cancerous skin growths that begin in keratinocytes and appear as waxy, scaly patches.",
+    'Tinea Ringworm Candidiasis and other Fungal Infections': "Fungal infections on the skin characterized by ring-shaped rashes. Highly contagious."
+}
+
+# Treatments for each condition and whether it is contagious
+remedies = {
+    'Eczema': {
+        'primary': 'An effective, intensive treatment for severe eczema involves applying a corticosteroid ointment and sealing in the medication with a wrap of wet gauze topped with a layer of dry gauze.',
+        'secondary': "DUPIXENT® (dupilumab) is a prescription medicine used to treat people aged 6 years and older with moderate-to-severe atopic dermatitis (eczema) that is not well controlled with prescription therapies used on the skin (topical) or who cannot use topical therapies. Other treatments for eczema include azathioprine, cyclosporine, methotrexate, pimecrolimus, crisaborole, and tacrolimus, which are prescription creams and ointments that control inflammation and reduce immune system reactions. Calcineurin inhibitors, such as pimecrolimus and tacrolimus, are also recommended if OTC steroids don't work or cause problems. Corticosteroid creams, solutions, gels, foams, and ointments, made with hydrocortisone steroids, can quickly relieve itching and reduce inflammation. Pimecrolimus cream or tacrolimus ointment, also known as topical calcineurin inhibitors (TCIs), may be prescribed by a dermatologist.",
+        'contagious': False
+    },
+    'Melanoma': {
+        'primary': "Treatment for early-stage melanomas usually includes surgery to remove the melanoma. A very thin melanoma may be removed entirely during the biopsy and require no further treatment. Otherwise, your surgeon will remove the cancer as well as a border of normal skin and a layer of tissue beneath the skin.",
+        'secondary': "Ipilimumab (Yervoy®) is an immunotherapy drug used to treat metastatic melanoma and stage III melanoma that cannot be removed completely with surgery. It works by blocking an immune molecule called CTLA-4. Checkpoint inhibitors, also known as immune checkpoint blockade, are commonly used to treat melanoma. Interferon alfa (Intron A, Roferon-A) can be used after surgery to prevent melanoma recurrence. Targeted therapy of melanoma includes vemurafenib, cobimetinib, dabrafenib, and trametinib, which attack cells that have a damaged BRAF gene. Targeted medicines for melanoma with NRAS and C-KIT mutations may be available through clinical trials.",
+        'contagious': False
+    },
+    'Atopic Dermatitis': {
+        'primary': "The main treatments for atopic eczema are: emollients (moisturisers) used every day to stop the skin becoming dry. topical corticosteroids creams and ointments used to reduce swelling and redness during flare-ups.",
+        'secondary': "DUPIXENT® (dupilumab) is a prescription medicine used to treat moderate-to-severe atopic dermatitis (eczema) that is not well controlled with prescription therapies used on the skin (topical), or who cannot use topical therapies. It is not known if DUPIXENT is safe and effective in children with atopic dermatitis under 6 years of age. Cibinqo (abrocitinib) is an oral JAK1 inhibitor approved by the FDA for adults with refractory moderate to severe atopic dermatitis whose disease is not adequately controlled with other systemic drug products, including biologics, or when use of those therapies is inadvisable. Immunosuppressants are prescribed for moderate to severe atopic dermatitis in children and adults to help stop the itch-scratch cycle of eczema, to allow the skin to heal and reduce the risk of skin infection. Topical calcineurin inhibitors, immunosuppressant tablets, and alitretinoin are some of the topical treatments for atopic dermatitis.",
+        'contagious': False
+    },
+    'Basal Cell Carcinoma (BCC)': {
+        'primary': "The current mainstay of BCC treatment involves surgical modalities such as excision, electrodesiccation and curettage (EDC), cryosurgery, and Mohs micrographic surgery. Such methods are typically reserved for localized BCC and offer high 5-year cure rates, generally over 95%.",
+        'secondary': "Basal cell skin cancer does not usually respond to chemotherapy, but it often responds to a targeted drug called vismodegib, sold as Erivedge®, which helps disrupt the activity of a group of proteins in the body called hedgehog. Erivedge® (vismodegib) capsule is a prescription medicine used to treat adults with basal cell carcinoma that has spread to other parts of the body or that has come back after surgery or that cannot be treated with surgery or radiation. It is the #1 most-prescribed oral medication for advanced basal cell carcinoma.",
+        'contagious': False
+    },
+    'Melanocytic Nevi (NV)': {
+        'primary': "Small nevi can be removed by simple surgical excision. The nevus is cut out, and the adjacent skin stitched together leaving a small scar. Removal of a large congenital nevus, however, requires replacement of the affected skin.",
+        'secondary': "Melanocytic nevus is the medical term for a mole. Nevi can appear anywhere on the body. They are benign (non-cancerous) and typically do not require treatment. A very small percentage of melanocytic nevi may develop a melanoma within them. Of note, the majority of cutaneous melanomas arise within normally appearing skin.",
+        'contagious': False
+    },
+    'Benign Keratosis-like Lesions (BKL)': {
+        'primary': "Cryosurgery: The dermatologist applies liquid nitrogen, a very cold liquid, to the growth with a cotton swab or spray gun. Electrosurgery and curettage: Electrosurgery (electrocautery) involves numbing the growth with an anesthetic and using an electric current to destroy the growth.",
+        'secondary': "A seborrheic keratosis is a growth on the skin. The growth is not cancer (benign). It's color can range from white, tan, brown, or black. Seborrheic keratoses often appear on a person's chest, arms, back, or other areas. They're very common in people older than age 50.",
+        'contagious': False
+    },
+    'Psoriasis pictures Lichen Planus and related diseases': {
+        'primary': "Lichen planus does not usually require treatment. It often goes away by itself within a year. If a person has particularly itchy or painful outbreaks, a doctor may prescribe topical corticosteroids or light therapy. Psoriasis is a long-term condition, but people can usually manage their symptoms well.",
+        'secondary': "There isn't a cure for lichen planus. If you have lichen planus on your skin, in most cases, it goes away without treatment in as little as a few months to several years. Corticosteroid creams or ointments. Your healthcare provider may prescribe corticosteroid creams or ointments to reduce inflammation. Phototherapy uses ultraviolet light, usually ultraviolet B (UVB), from special lamps. The ultraviolet light waves found in sunlight can help certain skin disorders, including lichen planus.",
+        'contagious': False
+    },
+    'Seborrheic Keratoses and other Benign Tumors': {
+        'primary': "Eskata, a 40% hydrogen peroxide topical solution, is the first FDA-approved drug for treatment of seborrheic keratoses. Administration of the drug may be tedious and usually requires at least two office visits.",
+        'secondary': "Ammonium lactate and alpha hydroxy acids have been reported to reduce the height of seborrheic keratoses, and superficial lesions can be treated by carefully applying pure trichloroacetic acid and repeating if the full thickness is not removed on the first treatment. Topical treatment with tazarotene cream 0.1% applied twice daily for 16 weeks caused clinical improvement in seborrheic keratoses in 7 of 15 patients. Diclofenac gel may be a new treatment option for seborrheic keratosis. Hydrogen peroxide 40% (Eskata) is a topical solution for the in-office treatment of raised seborrheic keratosis lesions.",
+        'contagious': False
+    },
+    'Tinea Ringworm Candidiasis and other Fungal Infections': {
+        'primary': "Typically, a course of antifungal creams (either prescription or over-the-counter) will clear up the rash and relieve the itchiness. Your healthcare provider can also discuss preventive steps to keep the rash from coming back.",
+        'secondary': "Tinea ringworm can be treated with over-the-counter (OTC) antifungal creams containing clotrimazole, ketoconazole, econazole, tolnaftate, or terbinafine. However, if there are many patchy areas, a prescription cream or oral antifungal medicine taken by mouth may be necessary.",
+        'contagious': True
+    },
+    'Warts Molluscum and other Viral Infections': {
+        'primary': "Doctors recommend many topical treatments for molluscum contagiosum. Podophyllotoxin (contraindicated in pregnant women), potassium hydroxide, salicylic acid (associated or not with povidone-iodine), benzoyl peroxide, and tretinoin are used as home treatments and must be applied to each lesion.",
+        'secondary': "Cantharidin (beetle juice): This FDA-approved treatment is made from blister beetles. It's approved to treat adults and children two years of age and older. Dermatologists have been using cantharidin to treat warts and molluscum since the 1950s. When treating molluscum bumps, your dermatologist applies the beetle juice to each bump. Your dermatologist will apply it to each bump in such a way that a water blister later forms.",
+        'contagious': True
+    }
+}
@@ -0,0 +1,127 @@
+# Distil skin.h5 into the small screener used by cascade.py.
+#
+# The student is EfficientNet-B0 at a lower input resolution behind a
+# Resizing layer, so it takes the same 300x300 batches as skin.h5. It is
+# trained on the notebook's split and class-balanced tf.data stream
+# (training_data.py) to match the teacher's temperature-softened
+# probabilities, plus a small weight on the true labels. A softmax temperature
+# is then fitted for the screener on the validation split and written next to
+# it (screener.calibration.json), so the cascade can calibrate the rows it
+# answers with the screener's own temperature.
+#
+#   python distill_screener.py path/to/IMG_CLASSES --teacher skin.h5 --output screener.h5 --size 160
+#   python distill_screener.py path/to/IMG_CLASSES --output screener.h5 --calibrate-only
+import argparse
+
+import numpy as np
+import tensorflow as tf
+
+import calibration
+from preprocessing import IMAGE_SIZE
+from training_data import make_datasets, preprocess, trim
+
+
+def build_student(classes, size, weights='imagenet'):
+    inputs = tf.keras.Input((IMAGE_SIZE[1], IMAGE_SIZE[0], 3))
+    x = tf.keras.layers.Resizing(size, size, interpolation='area')(inputs)
+    base = tf.keras.applications.EfficientNetB0(include_top=False, weights=weights, input_tensor=x, pooling='avg')
+    x = tf.keras.layers.Dropout(0.3)(base.output)
+    outputs = tf.keras.layers.Dense(classes, activation='softmax')(x)
+    return tf.keras.Model(inputs, outputs, name=f'screener_{size}')
+
+
+# Trains the student on soft targets from the frozen teacher. Both models
+# output probabilities; softening divides their log-probabilities by the
+# temperature, as calibration.apply_temperature does.
+class Distiller(tf.keras.Model):
+    def __init__(self, student, teacher, temperature=4.0, alpha=0.1):
+        super().__init__()
+        self.student = student
+        self.teacher = teacher
+        self.temperature = temperature
+        self.alpha = alpha
+        self.kl = tf.keras.losses.KLDivergence()
+        self.ce = tf.keras.losses.CategoricalCrossentropy()
+        self.agreement = tf.keras.metrics.Mean(name='agreement')
+
+    def soften(self, probabilities):
+        return tf.nn.softmax(tf.math.log(tf.clip_by_value(probabilities, 1e-7, 1.0)) / self.temperature)
+
+    def train_step(self, data):
+        images, labels = data
+        teacher = self.teacher(images, training=False)
+        with tf.GradientTape() as tape:
+            student = self.student(images, training=True)
+            distill = self.kl(self.soften(teacher), self.soften(student)) * self.temperature ** 2
+            loss = (1 - self.alpha) * distill + self.alpha * self.ce(labels, student)
+        self.optimizer.minimize(loss, self.student.trainable_variables, tape=tape)
+        self.agreement.update_state(tf.cast(tf.argmax(student, 1) == tf.argmax(teacher, 1), tf.float32))
+        return {'loss': loss, 'agreement': self.agreement.result()}
+
+    def test_step(self, data):
+        images, labels = data
+        teacher = self.teacher(images, training=False)
+        student = self.student(images, training=False)
+        self.agreement.update_state(tf.cast(tf.argmax(student, 1) == tf.argmax(teacher, 1), tf.float32))
+        return {'agreement': self.agreement.result()}
+
+    @property
+    def metrics(self):
+        return [self.agreement]
+
+
+# Fit the screener's temperature on the validation batches and write it with
+# a before/after report to path
+def calibrate_screener(student, valid, path):
+    probabilities, labels = [], []
+    for images, onehot in valid:
+        probabilities.append(np.asarray(student.predict_on_batch(images)))
+        labels.append(np.argmax(onehot, axis=1))
+    return calibration.calibrate(np.concatenate(probabilities), np.concatenate(labels), path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distil skin.h5 into a small screener model')
+    parser.add_argument('source', help='IMG_CLASSES directory with one folder per class')
+    parser.add_argument('--teacher', default='skin.h5')
+    parser.add_argument('--output', default='screener.h5')
+    parser.add_argument('--trsplit', type=float, default=0.8)
+    parser.add_argument('--vsplit', type=float, default=0.1)
+    parser.add_argument('--size', type=int, default=160, help='screener input resolution')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--samples-per-class', type=int, default=1006, help='per class and epoch, as max_samples in the notebook')
+    parser.add_argument('--temperature', type=float, default=4.0)
+    parser.add_argument('--alpha', type=float, default=0.1, help='weight of the true-label loss')
+    parser.add_argument('--cache-dir', default=None)
+    parser.add_argument('--weights', default='imagenet', help="student initialisation ('imagenet' or 'none')")
+    parser.add_argument('--calibrate-only', action='store_true', help='only fit the temperature of an existing --output')
+    args = parser.parse_args()
+
+    train_df, test_df, valid_df = preprocess(args.source, args.trsplit, args.vsplit)
+    train_df = trim(train_df, args.samples_per_class, 0, 'labels')
+    train, valid, _, classes, steps = make_datasets(train_df, valid_df, test_df, args.batch_size,
+                                                    cache_dir=args.cache_dir, samples_per_class=args.samples_per_class)
+
+    if args.calibrate_only:
+        student = tf.keras.models.load_model(args.output)
+    else:
+        teacher = tf.keras.models.load_model(args.teacher)
+        teacher.trainable = False
+        student = build_student(len(classes), args.size, None if args.weights == 'none' else args.weights)
+        distiller = Distiller(student, teacher, args.temperature, args.alpha)
+        distiller.compile(optimizer=tf.keras.optimizers.Adamax(learning_rate=1e-3))
+        distiller.fit(train, epochs=args.epochs, steps_per_epoch=steps, validation_data=valid,
+                      callbacks=[tf.keras.callbacks.ReduceLROnPlateau(monitor='val_agreement', mode='max', factor=0.5, patience=1)])
+        student.save(args.output)
+        print(f'screener saved to {args.output}')
+
+    path = calibration.calibration_path(args.output)
+    report = calibrate_screener(student, valid, path)
+    print(f"temperature {report['temperature']:.3f}  ECE {report['ece_before']:.4f} -> {report['ece_after']:.4f}  "
+          f"NLL {report['nll_before']:.4f} -> {report['nll_after']:.4f}, written to {path}")
+    print('run cascade.py to pick the escalation threshold')
+
+
+if __name__ == '__main__':
+    main()
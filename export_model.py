@@ -0,0 +1,99 @@
+# Convert skin.h5 to a TFLite model for CPU serving and report how closely it
+# agrees with the original Keras model.
+#
+#   python export_model.py --quantize int8 --calibration-dir IMG_CLASSES
+#   DERMATRIX_BACKEND=tflite streamlit run app.py
+#
+# --quantize:
+#   none     float32 weights
+#   float16  float16 weights, float32 compute
+#   dynamic  int8 weights, activations quantized on the fly
+#   int8     int8 weights and activations, calibrated on training images
+import argparse
+import os
+import random
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import inference
+from preprocessing import prepare_image, preprocess_batch
+
+
+# Yield calibration images one at a time as float32 (1, 300, 300, 3) batches
+def representative_dataset(paths):
+    def gen():
+        for path in paths:
+            yield [prepare_image(path)[np.newaxis, ...].astype(np.float32)]
+    return gen
+
+
+def convert(model, quantize, calibration_paths=None):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == 'dynamic':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif quantize == 'int8':
+        if not calibration_paths:
+            raise ValueError('int8 quantization needs calibration images (--calibration-dir)')
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset(calibration_paths)
+        # keep float kernels for any op without an int8 implementation
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS]
+    return converter.convert()
+
+
+# Mean seconds per image over a full pass of batch through model
+def time_per_image(model, batch, batch_size):
+    inference.run_model(batch[:1], model, batch_size)  # warm up
+    start = time.perf_counter()
+    predictions = inference.run_model(batch, model, batch_size)
+    return predictions, (time.perf_counter() - start) / len(batch)
+
+
+def compare(keras_model, tflite_path, paths, batch_size):
+    batch = preprocess_batch(paths)
+    tflite_model = inference.TFLiteModel(tflite_path)
+    reference, keras_time = time_per_image(keras_model, batch, batch_size)
+    exported, tflite_time = time_per_image(tflite_model, batch, batch_size)
+    agreement = np.mean(np.argmax(reference, axis=1) == np.argmax(exported, axis=1))
+    print(f'images compared:       {len(batch)}')
+    print(f'top-1 agreement:       {agreement * 100:6.2f} %')
+    print(f'max probability diff:  {np.max(np.abs(reference - exported)):.4f}')
+    print(f'keras latency:         {keras_time * 1000:8.2f} ms/image')
+    print(f'tflite latency:        {tflite_time * 1000:8.2f} ms/image')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export skin.h5 to TFLite')
+    parser.add_argument('--model', default='skin.h5')
+    parser.add_argument('--output', default='skin.tflite')
+    parser.add_argument('--quantize', choices=['none', 'float16', 'dynamic', 'int8'], default='none')
+    parser.add_argument('--calibration-dir', help='training images used to calibrate int8 activations')
+    parser.add_argument('--calibration-samples', type=int, default=200)
+    parser.add_argument('--eval-dir', default='Disease Images', help='images used to measure agreement with the .h5')
+    parser.add_argument('--batch-size', type=int, default=inference.BATCH_SIZE)
+    args = parser.parse_args()
+
+    model = tf.keras.models.load_model(args.model)
+    calibration_paths = None
+    if args.calibration_dir:
+        calibration_paths = inference.list_images(args.calibration_dir)
+        random.Random(123).shuffle(calibration_paths)
+        calibration_paths = calibration_paths[:args.calibration_samples]
+
+    with open(args.output, 'wb') as f:
+        f.write(convert(model, args.quantize, calibration_paths))
+    print(f'{args.output} written ({args.quantize})')
+    print(f'size: {os.path.getsize(args.model) / 2**20:.1f} MB -> {os.path.getsize(args.output) / 2**20:.1f} MB')
+
+    eval_paths = inference.list_images(args.eval_dir) if args.eval_dir else calibration_paths
+    if eval_paths:
+        compare(model, args.output, eval_paths, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+import hashlib
+import io
+import os
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+from conditions import class_names
+from preprocessing import IMAGE_SIZE, preprocess_batch
+
+# Inference backend: 'keras' runs skin.h5 with full TensorFlow, 'tflite' runs
+# the artifact written by export_model.py with the TFLite interpreter
+BACKEND = os.environ.get('DERMATRIX_BACKEND', 'keras')
+MODEL_PATH = os.environ.get('DERMATRIX_MODEL', 'skin.tflite' if BACKEND == 'tflite' else 'skin.h5')
+
+# Number of images sent through the model in a single forward pass
+BATCH_SIZE = int(os.environ.get('DERMATRIX_BATCH_SIZE', 32))
+
+# When set, predictions are sent to an inference_server.py worker at this URL
+# instead of running the model in the app process
+INFERENCE_URL = os.environ.get('DERMATRIX_INFERENCE_URL')
+
+
+# Client for an out-of-process inference worker. Exposes predict_on_batch so
+# it can be passed anywhere a Keras model is expected.
+class RemoteModel:
+    def __init__(self, url, timeout=60):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def predict_on_batch(self, batch):
+        request = urllib.request.Request(
+            self.url + '/predict',
+            data=encode_array(np.asarray(batch, dtype=np.uint8)),
+            headers={'Content-Type': 'application/octet-stream'},
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return decode_array(response.read())
+
+
+# Runs a .tflite model. Uses the standalone tflite_runtime package when it is
+# installed so the process never has to import TensorFlow.
+class TFLiteModel:
+    def __init__(self, path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=path, num_threads=num_threads)
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.interpreter.allocate_tensors()
+        self.lock = threading.Lock()
+
+    def predict_on_batch(self, batch):
+        batch = np.asarray(batch, dtype=self.input['dtype'])
+        with self.lock:
+            if tuple(self.interpreter.get_input_details()[0]['shape']) != batch.shape:
+                self.interpreter.resize_tensor_input(self.input['index'], batch.shape)
+                self.interpreter.allocate_tensors()
+            self.interpreter.set_tensor(self.input['index'], batch)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output['index']).copy()
+
+
+# Keras model that also returns the features feeding the 256-unit Dense
+# layer (the max-pooled, batch-normalised EfficientNet output) from the same
+# forward pass. predict_on_batch still returns only probabilities.
+class EmbeddingModel:
+    def __init__(self, model):
+        import tensorflow as tf
+        dense = next(layer for layer in model.layers if isinstance(layer, tf.keras.layers.Dense))
+        self.model = model
+        self.dual = tf.keras.Model(model.inputs, [model.output, dense.input])
+
+    def predict_on_batch(self, batch):
+        return self.predict_with_embeddings(batch)[0]
+
+    def predict_with_embeddings(self, batch):
+        probabilities, embeddings = self.dual.predict_on_batch(batch)
+        return np.asarray(probabilities), np.asarray(embeddings)
+
+
+# Arrays travel between the app and the worker in .npy format
+def encode_array(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def decode_array(data):
+    return np.load(io.BytesIO(data), allow_pickle=False)
+
+
+# Load the trained model (Keras .h5 or .tflite), or connect to the inference
+# worker when DERMATRIX_INFERENCE_URL is set
+def load_model(path=MODEL_PATH, url=INFERENCE_URL):
+    if url:
+        return RemoteModel(url)
+    if path.endswith('.tflite'):
+        return TFLiteModel(path)
+    import tensorflow as tf
+    return tf.keras.models.load_model(path)
+
+
+# Whether load_model(path, url) can be wrapped in an EmbeddingModel
+def supports_embeddings(path=MODEL_PATH, url=INFERENCE_URL):
+    return not url and not path.endswith('.tflite')
+
+
+# Identifies the weights a prediction came from: a hash of the model file, or
+# the worker URL when predictions are remote
+def model_version(path=MODEL_PATH, url=INFERENCE_URL):
+    if url:
+        return url
+    if not os.path.exists(path):
+        return path
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+# Run a dummy image through the model so graph building and tracing happen
+# before the first real request. Both stages of a cascade are warmed up
+# directly, whichever one the dummy image would reach.
+def warm_up(model):
+    if hasattr(model, 'screener'):
+        warm_up(model.screener)
+        warm_up(model.full)
+        return
+    run_model(np.zeros((1, IMAGE_SIZE[1], IMAGE_SIZE[0], 3), dtype=np.uint8), model)
+
+
+# Loads and warms up the model on a background thread. Construct it as early
+# as possible; get() blocks until the model is ready. With embeddings=True a
+# Keras model is wrapped in an EmbeddingModel before warm-up. With a screener
+# path the model runs behind cascade.CascadeModel, which only returns
+# probabilities (already calibrated), so embeddings are then turned off.
+class ModelLoader:
+    def __init__(self, path=MODEL_PATH, url=INFERENCE_URL, embeddings=False, screener=None):
+        self.path = path
+        self.url = url
+        self.screener = None if url else screener
+        self.embeddings = embeddings and supports_embeddings(path, url) and not self.screener
+        self.model = None
+        self.error = None
+        self.load_seconds = None
+        self.warm_up_seconds = None
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._load, name='model-loader', daemon=True)
+        self.thread.start()
+
+    def _load(self):
+        try:
+            start = time.perf_counter()
+            model = load_model(self.path, self.url)
+            if self.embeddings:
+                model = EmbeddingModel(model)
+            if self.screener:
+                from cascade import CascadeModel, load_temperatures
+                model = CascadeModel(load_model(self.screener, url=None), model,
+                                     temperatures=load_temperatures(self.screener, self.path))
+            loaded = time.perf_counter()
+            # the inference worker warms up its own model
+            if not isinstance(model, RemoteModel):
+                warm_up(model)
+            self.load_seconds = loaded - start
+            self.warm_up_seconds = time.perf_counter() - loaded
+            self.model = model
+            print(f'Model ready in {self.startup_seconds:.2f} s '
+                  f'(load {self.load_seconds:.2f} s, warm-up {self.warm_up_seconds:.2f} s)', flush=True)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ready.set()
+
+    # Seconds from construction until the model could serve its first request
+    @property
+    def startup_seconds(self):
+        if self.load_seconds is None:
+            return None
+        return self.load_seconds + self.warm_up_seconds
+
+    def get(self, timeout=None):
+        if not self.ready.wait(timeout):
+            raise TimeoutError('model is still loading')
+        if self.error is not None:
+            raise self.error
+        return self.model
+
+
+# All .jpg/.jpeg/.png files below directory, sorted
+def list_images(directory):
+    paths = []
+    for root, _, files in os.walk(directory):
+        for f in files:
+            if f.lower().endswith(('.jpg', '.jpeg', '.png')):
+                paths.append(os.path.join(root, f))
+    return sorted(paths)
+
+
+# Score a list of images (PIL images, paths or file objects). Decoding and
+# resizing run on a thread pool straight into one uint8 batch, which is sent
+# through the model batch_size images at a time. Returns an (n, classes)
+# array of probabilities in the same order as the input.
+def predict_batch(images, model, batch_size=BATCH_SIZE, workers=None):
+    images = list(images)
+    if not images:
+        return np.empty((0, len(class_names)), dtype=np.float32)
+    return run_model(preprocess_batch(images, workers=workers), model, batch_size)
+
+
+# Send a preprocessed uint8 batch through the model batch_size images at a time
+def run_model(batch, model, batch_size=BATCH_SIZE):
+    predictions = []
+    for start in range(0, len(batch), batch_size):
+        predictions.append(np.asarray(model.predict_on_batch(batch[start:start + batch_size])))
+    return np.concatenate(predictions)
+
+
+# Like run_model for an EmbeddingModel; returns probabilities and embeddings
+def run_model_with_embeddings(batch, model, batch_size=BATCH_SIZE):
+    probabilities, embeddings = [], []
+    for start in range(0, len(batch), batch_size):
+        p, e = model.predict_with_embeddings(batch[start:start + batch_size])
+        probabilities.append(p)
+        embeddings.append(e)
+    return np.concatenate(probabilities), np.concatenate(embeddings)
+
+
+# One row per image with the most likely condition and its probability, and
+# optionally whether it falls below the referral threshold
+def prediction_table(names, predictions, refer_threshold=None):
+    rows = []
+    for name, p in zip(names, predictions):
+        index = int(np.argmax(p))
+        row = {
+            'Image': name,
+            'Detected Condition': class_names[index],
+            'Probability': float(p[index]),
+        }
+        if refer_threshold is not None:
+            row['Refer to Dermatologist'] = bool(p[index] < refer_threshold)
+        rows.append(row)
+    return rows
@@ -0,0 +1,186 @@
+# Local inference worker for the Streamlit app.
+#
+# Holds the model in its own process and batches requests from all app
+# sessions together: a batch is run as soon as max_batch_size images are
+# waiting or the oldest request has waited max_wait_ms.
+#
+#   python inference_server.py --port 8600
+#   DERMATRIX_INFERENCE_URL=http://127.0.0.1:8600 streamlit run app.py
+#
+# Endpoints:
+#   POST /predict  .npy uint8 batch (n, 300, 300, 3) -> .npy float32 probabilities
+#   GET  /metrics  JSON with queue depth, the batch size histogram and, with
+#                  --screener, the cascade's escalation rate
+#   GET  /health   200 once the model is loaded
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import inference
+from preprocessing import IMAGE_SIZE
+
+# Shape of one image in a /predict batch, as preprocess_batch produces it
+BATCH_SHAPE = (IMAGE_SIZE[1], IMAGE_SIZE[0], 3)
+
+
+class _Request:
+    def __init__(self, images):
+        self.images = images
+        self.future = Future()
+
+
+# Collects incoming requests and runs them through predict_fn together
+class DynamicBatcher:
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=5.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.batch_sizes = Counter()  # images per executed batch -> number of batches
+        self.requests = 0
+        self.images = 0
+        self.thread = threading.Thread(target=self._run, name='dynamic-batcher', daemon=True)
+        self.thread.start()
+
+    # Queue a uint8 batch and return a Future for its probabilities
+    def submit(self, images):
+        request = _Request(images)
+        self.queue.put(request)
+        return request.future
+
+    def predict(self, images):
+        return self.submit(images).result()
+
+    def _collect(self):
+        pending = [self.queue.get()]
+        size = len(pending[0].images)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            pending.append(request)
+            size += len(request.images)
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            size = sum(len(r.images) for r in pending)
+            try:
+                predictions = self.predict_fn(np.concatenate([r.images for r in pending]))
+            except Exception as e:
+                for r in pending:
+                    r.future.set_exception(e)
+            else:
+                start = 0
+                for r in pending:
+                    r.future.set_result(predictions[start:start + len(r.images)])
+                    start += len(r.images)
+            with self.lock:
+                self.batch_sizes[size] += 1
+                self.requests += len(pending)
+                self.images += size
+
+    def stats(self):
+        with self.lock:
+            batches = sum(self.batch_sizes.values())
+            return {
+                'queue_depth': self.queue.qsize(),
+                'requests': self.requests,
+                'images': self.images,
+                'batches': batches,
+                'mean_batch_size': self.images / batches if batches else 0.0,
+                'batch_size_histogram': {str(k): v for k, v in sorted(self.batch_sizes.items())},
+            }
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    batcher = None
+    cascade = None
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self.send_error(404)
+            return
+        try:
+            images = inference.decode_array(self.rfile.read(int(self.headers['Content-Length'])))
+            if images.ndim != 4 or images.dtype != np.uint8 or images.shape[1:] != BATCH_SHAPE:
+                raise ValueError(f'expected a uint8 (n, {IMAGE_SIZE[1]}, {IMAGE_SIZE[0]}, 3) batch, '
+                                 f'got {images.dtype} {images.shape}')
+        except Exception as e:
+            self.send_error(400, str(e))
+            return
+        try:
+            predictions = self.batcher.predict(images)
+        except Exception as e:
+            self.send_error(500, str(e))
+            return
+        self._send(inference.encode_array(np.asarray(predictions, dtype=np.float32)), 'application/octet-stream')
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            stats = self.batcher.stats()
+            if self.cascade is not None:
+                stats['cascade'] = self.cascade.stats()
+            self._send(json.dumps(stats).encode(), 'application/json')
+        elif self.path == '/health':
+            self._send(b'ok', 'text/plain')
+        else:
+            self.send_error(404)
+
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the Dermatrix inference worker')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--model', default=inference.MODEL_PATH)
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    parser.add_argument('--screener', default=None, help='run the model behind this screener (see cascade.py)')
+    args = parser.parse_args()
+
+    model = inference.load_model(args.model, url=None)
+    if args.screener:
+        from cascade import CascadeModel, load_temperatures
+        # the app applies the full model's temperature to everything the worker
+        # returns, so screener rows are pre-scaled by the ratio of the two and
+        # end up calibrated by the screener's own temperature
+        screener_temperature, full_temperature = load_temperatures(args.screener, args.model)
+        model = InferenceHandler.cascade = CascadeModel(inference.load_model(args.screener, url=None), model,
+                                                        temperatures=(screener_temperature / full_temperature, 1.0))
+    inference.warm_up(model)
+    InferenceHandler.batcher = DynamicBatcher(
+        lambda batch: inference.run_model(batch, model, args.max_batch_size),
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), InferenceHandler)
+    print(f'Inference worker listening on http://{args.host}:{args.port}', flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
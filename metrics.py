@@ -0,0 +1,182 @@
+# Per-stage latency metrics for the app and the benchmark.
+#
+# Every stage of a Detection request (reading the upload, decoding and
+# resizing, the forward pass, rendering, ...) is timed into a histogram with
+# fixed Prometheus buckets, and the most recent samples are kept for exact
+# p50/p95/p99. The registry can be scraped in Prometheus text format from a
+# local port (DERMATRIX_METRICS_PORT) and every request can be appended to a
+# JSON-lines log (DERMATRIX_METRICS_LOG).
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+METRICS_PORT = os.environ.get('DERMATRIX_METRICS_PORT')
+METRICS_LOG = os.environ.get('DERMATRIX_METRICS_LOG')
+
+# Upper bounds in seconds of the Prometheus histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+# Latency distribution of one stage
+class Histogram:
+    def __init__(self, window=2048):
+        self.counts = np.zeros(len(BUCKETS) + 1, dtype=np.int64)  # last bucket is +Inf
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self.counts[np.searchsorted(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    # p50/p95/p99 in seconds over the last window samples
+    def quantiles(self):
+        if not self.recent:
+            return {q: 0.0 for q in QUANTILES}
+        values = np.percentile(np.fromiter(self.recent, dtype=np.float64), [q * 100 for q in QUANTILES])
+        return dict(zip(QUANTILES, values.tolist()))
+
+
+class Metrics:
+    def __init__(self, log_path=None, window=2048):
+        self.log_path = log_path
+        self.window = window
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram(self.window)
+            self.histograms[stage].observe(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    # Append one JSON line per request when a log path is configured
+    def log(self, record):
+        if not self.log_path:
+            return
+        line = json.dumps(record) + '\n'
+        with self.lock:
+            with open(self.log_path, 'a') as f:
+                f.write(line)
+
+    # {stage: {count, mean, p50, p95, p99}} with times in milliseconds
+    def snapshot(self):
+        with self.lock:
+            result = {}
+            for stage, h in sorted(self.histograms.items()):
+                quantiles = h.quantiles()
+                result[stage] = {
+                    'count': h.count,
+                    'mean_ms': h.sum / max(h.count, 1) * 1000,
+                    **{f'p{int(q * 100)}_ms': v * 1000 for q, v in quantiles.items()},
+                }
+            return result
+
+    def prometheus(self, prefix='dermatrix'):
+        lines = [
+            f'# HELP {prefix}_stage_seconds Time spent in each stage of a request',
+            f'# TYPE {prefix}_stage_seconds histogram',
+        ]
+        with self.lock:
+            items = sorted(self.histograms.items())
+            for stage, h in items:
+                cumulative = np.cumsum(h.counts)
+                for bound, count in zip(BUCKETS, cumulative):
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {cumulative[-1]}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {h.sum}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {h.count}')
+            lines.append(f'# HELP {prefix}_stage_latency_seconds Recent p50/p95/p99 of each stage')
+            lines.append(f'# TYPE {prefix}_stage_latency_seconds summary')
+            for stage, h in items:
+                for q, v in h.quantiles().items():
+                    lines.append(f'{prefix}_stage_latency_seconds{{stage="{stage}",quantile="{q}"}} {v}')
+                lines.append(f'{prefix}_stage_latency_seconds_sum{{stage="{stage}"}} {h.sum}')
+                lines.append(f'{prefix}_stage_latency_seconds_count{{stage="{stage}"}} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+
+# Stage timings of a single request. Each stage is recorded in the registry
+# as it finishes; finish() records the total and writes the request to the log.
+# With remainder set, the time not covered by any stage is recorded under
+# that name (e.g. rendering, which is spread over the whole script run).
+class Trace:
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+        self.stages = {}
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stages[stage] = self.stages.get(stage, 0.0) + elapsed
+            self.registry.observe(stage, elapsed)
+
+    def finish(self, remainder=None, **fields):
+        total = time.perf_counter() - self.start
+        if remainder:
+            self.stages[remainder] = max(total - sum(self.stages.values()), 0.0)
+            self.registry.observe(remainder, self.stages[remainder])
+        self.registry.observe(self.name, total)
+        self.registry.log({
+            'time': time.time(),
+            'request': self.name,
+            'total_ms': total * 1000,
+            **{f'{stage}_ms': seconds * 1000 for stage, seconds in self.stages.items()},
+            **fields,
+        })
+        return total
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send(self.registry.prometheus().encode(), 'text/plain; version=0.0.4')
+        elif self.path == '/metrics.json':
+            self._send(json.dumps(self.registry.snapshot()).encode(), 'application/json')
+        else:
+            self.send_error(404)
+
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve registry on a daemon thread: /metrics (Prometheus) and /metrics.json
+def serve(registry, port, host='127.0.0.1'):
+    handler = type('Handler', (MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, int(port)), handler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
@@ -0,0 +1,149 @@
+# Packed, memory-mapped copy of the IMG_CLASSES corpus.
+#
+# Packing decodes every image once, resizes it to the model input and writes
+# it as uint8 NHWC into .npy shards of shard_size images. index.npz stores
+# the file path, class index, split and position of every image, with the
+# same stratified train/valid/test split as the notebook's preprocess().
+# Rows are ordered by split, so reading a split in order is slicing views of
+# the memory-mapped shards: nothing is decoded or copied, and every process
+# reading the store shares the same page cache.
+#
+#   python packed_dataset.py path/to/IMG_CLASSES packed/
+import argparse
+import math
+import os
+
+import numpy as np
+
+from preprocessing import IMAGE_SIZE, preprocess_batch
+
+SPLITS = ('train', 'valid', 'test')
+
+
+# Write frames ({split name: frame with filepaths/labels}) to directory
+def pack(frames, directory, classes=None, shard_size=4096, image_size=IMAGE_SIZE, chunk_size=256,
+         x_col='filepaths', y_col='labels'):
+    if classes is None:
+        classes = sorted(frames['train'][y_col].unique())
+    class_index = {name: i for i, name in enumerate(classes)}
+    paths = np.concatenate([frames[s][x_col].to_numpy(dtype=str) for s in SPLITS])
+    labels = np.concatenate([frames[s][y_col].map(class_index).to_numpy(dtype=np.int16) for s in SPLITS])
+    split = np.concatenate([np.full(len(frames[s]), i, dtype=np.uint8) for i, s in enumerate(SPLITS)])
+
+    os.makedirs(directory, exist_ok=True)
+    for shard in range(math.ceil(len(paths) / shard_size)):
+        start = shard * shard_size
+        stop = min(start + shard_size, len(paths))
+        images = np.lib.format.open_memmap(os.path.join(directory, f'shard_{shard:05d}.npy'), mode='w+',
+                                           dtype=np.uint8, shape=(stop - start, image_size[1], image_size[0], 3))
+        # decode straight into the memory-mapped shard
+        for offset in range(0, stop - start, chunk_size):
+            end = min(offset + chunk_size, stop - start)
+            preprocess_batch(paths[start + offset:start + end], image_size, out=images[offset:end], crop=False)
+        images.flush()
+        del images
+        print(f'shard {shard}: images {start}-{stop - 1}', flush=True)
+
+    np.savez(os.path.join(directory, 'index.npz'), paths=paths, labels=labels, split=split,
+             classes=np.array(classes), shard_size=shard_size)
+
+
+# One split of a packed store. Has the class_indices, labels and filenames
+# attributes of a Keras directory iterator, so the notebook's print_info can
+# take it in place of test_gen.
+class PackedSplit:
+    def __init__(self, store, start, stop):
+        self.store = store
+        self.start = start
+        self.stop = stop
+        self.labels = store.labels[start:stop]
+        self.filenames = list(store.paths[start:stop])
+        self.class_indices = {name: i for i, name in enumerate(store.classes)}
+
+    def __len__(self):
+        return self.stop - self.start
+
+    # Images [start, stop) of the split: a view when they sit in one shard
+    def slice(self, start, stop):
+        return self.store.slice(self.start + start, self.start + min(stop, len(self)))
+
+    # (images, labels) batches in order. With shuffle each batch gathers a
+    # random set of rows instead (a copy, but still no decoding).
+    def batches(self, batch_size, shuffle=False, seed=None):
+        if not shuffle:
+            for start in range(0, len(self), batch_size):
+                yield self.slice(start, start + batch_size), self.labels[start:start + batch_size]
+            return
+        order = np.random.default_rng(seed).permutation(len(self))
+        for start in range(0, len(self), batch_size):
+            rows = np.sort(order[start:start + batch_size])
+            yield self.store.gather(self.start + rows), self.labels[rows]
+
+    # Model probabilities for the whole split, in order
+    def predict(self, model, batch_size=32):
+        outputs = [np.asarray(model.predict_on_batch(images)) for images, _ in self.batches(batch_size)]
+        return np.concatenate(outputs)
+
+    # tf.data pipeline of (float32 images, one-hot labels) fed from the shards
+    def dataset(self, batch_size, shuffle=False, seed=None):
+        import tensorflow as tf
+        classes = len(self.class_indices)
+        shape = self.store.shards[0].shape[1:]
+        dataset = tf.data.Dataset.from_generator(
+            lambda: self.batches(batch_size, shuffle, seed),
+            output_signature=(tf.TensorSpec((None, *shape), tf.uint8), tf.TensorSpec((None,), tf.int64)))
+        dataset = dataset.map(lambda images, labels: (tf.cast(images, tf.float32), tf.one_hot(labels, classes)))
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+class PackedDataset:
+    def __init__(self, directory):
+        index = np.load(os.path.join(directory, 'index.npz'))
+        self.paths = index['paths']
+        self.labels = index['labels'].astype(np.int64)
+        self.split_ids = index['split']
+        self.classes = list(index['classes'])
+        self.shard_size = int(index['shard_size'])
+        count = math.ceil(len(self.paths) / self.shard_size)
+        self.shards = [np.load(os.path.join(directory, f'shard_{i:05d}.npy'), mmap_mode='r') for i in range(count)]
+
+    def split(self, name):
+        rows = np.flatnonzero(self.split_ids == SPLITS.index(name))
+        if len(rows) == 0:
+            return PackedSplit(self, 0, 0)
+        return PackedSplit(self, int(rows[0]), int(rows[-1]) + 1)
+
+    def slice(self, start, stop):
+        first, last = start // self.shard_size, (stop - 1) // self.shard_size
+        if first == last:
+            offset = first * self.shard_size
+            return self.shards[first][start - offset:stop - offset]
+        # the range crosses a shard boundary
+        parts = []
+        for shard in range(first, last + 1):
+            offset = shard * self.shard_size
+            parts.append(self.shards[shard][max(start - offset, 0):min(stop - offset, self.shard_size)])
+        return np.concatenate(parts)
+
+    # Rows at the given sorted global indices
+    def gather(self, rows):
+        shard = rows // self.shard_size
+        return np.concatenate([self.shards[s][rows[shard == s] - s * self.shard_size] for s in np.unique(shard)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack IMG_CLASSES into memory-mapped shards')
+    parser.add_argument('source', help='directory with one folder per class')
+    parser.add_argument('output')
+    parser.add_argument('--trsplit', type=float, default=0.8)
+    parser.add_argument('--vsplit', type=float, default=0.1)
+    parser.add_argument('--shard-size', type=int, default=4096)
+    args = parser.parse_args()
+
+    from training_data import preprocess
+    train_df, test_df, valid_df = preprocess(args.source, args.trsplit, args.vsplit)
+    pack({'train': train_df, 'valid': valid_df, 'test': test_df}, args.output, shard_size=args.shard_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# Content-addressed cache of prediction vectors.
+#
+# Keys are a SHA-256 of the model version and the uploaded file bytes, so the
+# same photo is never scored twice by the same model. The in-process tier is
+# an LRU bounded by max_entries; the optional SQLite tier at path is shared by
+# every app worker on the host and keeps at most max_disk_entries rows.
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from inference import decode_array, encode_array
+
+
+class PredictionCache:
+    def __init__(self, max_entries=1024, path=None, max_disk_entries=100000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, value BLOB NOT NULL)')
+
+    @staticmethod
+    def key(data, model_version):
+        digest = hashlib.sha256(model_version.encode())
+        digest.update(b'\0')
+        digest.update(data)
+        return digest.hexdigest()
+
+    # Stored probability vector for key, or None
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            if self.db is not None:
+                row = self.db.execute('SELECT value FROM predictions WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    value = decode_array(row[0])
+                    self._remember(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        value = np.array(value, dtype=np.float32)
+        with self.lock:
+            self._remember(key, value)
+            if self.db is not None:
+                self.db.execute('INSERT OR REPLACE INTO predictions (key, value) VALUES (?, ?)', (key, encode_array(value)))
+                # drop the oldest rows once the table grows past its bound
+                self.db.execute('DELETE FROM predictions WHERE rowid <= '
+                                '(SELECT MAX(rowid) FROM predictions) - ?', (self.max_disk_entries,))
+
+    def _remember(self, key, value):
+        value.setflags(write=False)
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
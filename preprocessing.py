@@ -0,0 +1,95 @@
+# Image preprocessing for inference.
+#
+# Uploads are decoded with JPEG draft mode, so the decoder scales 12 MP phone
+# photos down by 1/2, 1/4 or 1/8 instead of producing full-resolution pixels
+# that are immediately thrown away. EXIF orientation, alpha and grayscale are
+# normalised to RGB once, then each image is centre-cropped and resized (the
+# same geometry as ImageOps.fit) straight into a preallocated uint8 batch.
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageOps
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+IMAGE_SIZE = (300, 300)  # (width, height)
+
+# Resize with OpenCV instead of PIL when it is installed
+USE_OPENCV = os.environ.get('DERMATRIX_OPENCV', '0') == '1' and cv2 is not None
+
+
+# Open an image and decode it at the smallest scale that still covers size.
+# Accepts a PIL image or anything Image.open accepts (path, file object).
+def load_image(source, size=IMAGE_SIZE):
+    image = source if isinstance(source, Image.Image) else Image.open(source)
+    if image.format == 'JPEG':
+        image.draft('RGB', size)
+    image = ImageOps.exif_transpose(image)
+    return to_rgb(image)
+
+
+# Convert any PIL mode to RGB, flattening transparency onto white
+def to_rgb(image):
+    if image.mode == 'RGB':
+        return image
+    if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    if image.mode.startswith('I'):
+        # 16/32-bit grayscale: scale down to 8 bits before converting
+        image = image.point(lambda v: v * (255 / 65535)).convert('L')
+    return image.convert('RGB')
+
+
+# Centred crop box with the aspect ratio of size, as used by ImageOps.fit
+def fit_box(image_size, size=IMAGE_SIZE):
+    width, height = image_size
+    aspect = size[0] / size[1]
+    if width / height > aspect:
+        crop = height * aspect
+        return ((width - crop) / 2, 0, (width + crop) / 2, height)
+    crop = width / aspect
+    return (0, (height - crop) / 2, width, (height + crop) / 2)
+
+
+# Crop and resize an RGB image into out, a (height, width, 3) uint8 array.
+# With crop=False the whole image is squeezed to size, as the training
+# generators do.
+def fit_into(image, out, size=IMAGE_SIZE, use_opencv=USE_OPENCV, crop=True):
+    box = fit_box(image.size, size) if crop else (0, 0, image.width, image.height)
+    if use_opencv:
+        left, top, right, bottom = (int(round(v)) for v in box)
+        region = np.asarray(image)[top:bottom, left:right]
+        shrinking = region.shape[1] > size[0]
+        cv2.resize(region, size, dst=out, interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR)
+    else:
+        out[...] = image.resize(size, Image.LANCZOS, box=box)
+    return out
+
+
+# A single image as a (height, width, 3) uint8 array
+def prepare_image(image, size=IMAGE_SIZE, use_opencv=USE_OPENCV, crop=True):
+    out = np.empty((size[1], size[0], 3), dtype=np.uint8)
+    return fit_into(load_image(image, size), out, size, use_opencv, crop)
+
+
+# Decode and fit images on a thread pool (PIL and OpenCV release the GIL) and
+# write them into one (n, height, width, 3) uint8 batch. Pass out to reuse a
+# buffer between calls.
+def preprocess_batch(images, size=IMAGE_SIZE, workers=None, use_opencv=USE_OPENCV, out=None, crop=True):
+    images = list(images)
+    if out is None:
+        out = np.empty((len(images), size[1], size[0], 3), dtype=np.uint8)
+
+    def work(i):
+        fit_into(load_image(images[i], size), out[i], size, use_opencv, crop)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(work, range(len(images))))
+    return out
@@ -0,0 +1,165 @@
+# Nearest-neighbour index of labelled reference images for similar-case
+# retrieval.
+#
+# Every reference image is embedded with inference.EmbeddingModel (the
+# features feeding the 256-unit Dense layer), L2-normalised and stored as
+# float16. The rows are grouped into inverted lists by spherical k-means, so a
+# query scores the list centroids, then only the rows of the closest probes
+# lists. vectors.npy is memory-mapped: app workers on one host share the same
+# pages and a query reads only the lists it probes.
+#
+#   python similarity_index.py path/to/IMG_CLASSES --model skin.h5 --output similar_cases
+#   python similarity_index.py --packed packed/ --model skin.h5 --output similar_cases
+import argparse
+import math
+import os
+import time
+
+import numpy as np
+
+import inference
+from preprocessing import preprocess_batch
+
+
+def normalise(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+# Index of the closest centroid for every row, chunk rows at a time
+def assign(vectors, centroids, chunk=8192):
+    return np.concatenate([np.argmax(normalise(vectors[i:i + chunk]) @ centroids.T, axis=1)
+                           for i in range(0, len(vectors), chunk)])
+
+
+# Spherical k-means on at most sample rows of unit vectors
+def kmeans(vectors, lists, iterations=20, sample=50000, seed=123):
+    rng = np.random.default_rng(seed)
+    train = vectors[np.sort(rng.choice(len(vectors), min(sample, len(vectors)), replace=False))]
+    centroids = train[rng.choice(len(train), lists, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign(train, centroids)
+        counts = np.bincount(labels, minlength=lists)
+        used = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[used]
+        sums = np.zeros_like(centroids)
+        sums[used] = np.add.reduceat(train[np.argsort(labels, kind='stable')], starts, axis=0)
+        # restart empty lists from random rows
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = train[rng.choice(len(train), len(empty))]
+        centroids = normalise(sums)
+    return centroids
+
+
+# Write the index for (n, d) embeddings to directory. labels index classes
+# (-1 when unknown); model_version ties the index to the weights that made it.
+def build(embeddings, paths, labels, classes, directory, model_version, lists=None, iterations=20):
+    vectors = normalise(embeddings)
+    lists = lists or min(len(vectors), max(1, int(round(4 * math.sqrt(len(vectors))))))
+    centroids = kmeans(vectors, lists, iterations)
+    owner = assign(vectors, centroids)
+    order = np.argsort(owner, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(owner, minlength=lists))])
+
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'vectors.npy'), vectors[order].astype(np.float16))
+    np.save(os.path.join(directory, 'centroids.npy'), centroids)
+    np.savez(os.path.join(directory, 'index.npz'), offsets=offsets, paths=np.asarray(paths)[order],
+             labels=np.asarray(labels)[order], classes=np.array(classes), model_version=model_version)
+
+
+class SimilarityIndex:
+    def __init__(self, directory):
+        index = np.load(os.path.join(directory, 'index.npz'))
+        self.offsets = index['offsets']
+        self.paths = index['paths']
+        self.labels = index['labels']
+        self.classes = list(index['classes'])
+        self.model_version = str(index['model_version'])
+        self.centroids = np.load(os.path.join(directory, 'centroids.npy'))
+        self.vectors = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.vectors)
+
+    # Row numbers and cosine similarities of the k nearest rows, closest first
+    def nearest(self, embedding, k=5, probes=8):
+        query = normalise(embedding)
+        lists = np.argsort(-(self.centroids @ query))[:probes]
+        rows = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+        candidates = np.concatenate([self.vectors[self.offsets[l]:self.offsets[l + 1]] for l in lists])
+        scores = candidates.astype(np.float32) @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return rows[top], scores[top]
+
+    # [(path, class name or None, similarity)] of the k most similar references
+    def search(self, embedding, k=5, probes=8):
+        rows, scores = self.nearest(embedding, k, probes)
+        return [(str(self.paths[r]), self.classes[self.labels[r]] if self.labels[r] >= 0 else None, float(s))
+                for r, s in zip(rows, scores)]
+
+
+# Embeddings of images (paths or a uint8 array) in batches of batch_size
+def embed(images, model, batch_size=32, crop=True):
+    outputs = []
+    for start in range(0, len(images), batch_size):
+        chunk = images[start:start + batch_size]
+        if not isinstance(chunk, np.ndarray):
+            chunk = preprocess_batch(chunk, crop=crop)
+        outputs.append(model.predict_with_embeddings(chunk)[1])
+    return np.concatenate(outputs)
+
+
+# Recall@k of the index against exact search and mean query time in ms, for
+# queries taken from the indexed rows themselves
+def evaluate(index, k=5, probes=8, queries=200, seed=123):
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(index.vectors, dtype=np.float32)
+    picked = rng.choice(len(vectors), min(queries, len(vectors)), replace=False)
+    found = 0
+    start = time.perf_counter()
+    approximate = [set(index.nearest(vectors[q], k, probes)[0]) for q in picked]
+    elapsed = time.perf_counter() - start
+    for q, rows in zip(picked, approximate):
+        exact = np.argpartition(-(vectors @ vectors[q]), k - 1)[:k]
+        found += len(rows.intersection(exact))
+    return found / (len(picked) * k), elapsed * 1000 / len(picked)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the similar-case index')
+    parser.add_argument('source', nargs='?', help='directory with one folder per class')
+    parser.add_argument('--packed', help='packed_dataset.py store to embed instead of source')
+    parser.add_argument('--model', default=inference.MODEL_PATH)
+    parser.add_argument('--output', default='similar_cases')
+    parser.add_argument('--lists', type=int, default=None, help='number of inverted lists (default 4 * sqrt(n))')
+    parser.add_argument('--batch-size', type=int, default=inference.BATCH_SIZE)
+    args = parser.parse_args()
+    if not args.source and not args.packed:
+        parser.error('give a source directory or --packed')
+
+    model = inference.EmbeddingModel(inference.load_model(args.model, url=None))
+    start = time.perf_counter()
+    if args.packed:
+        from packed_dataset import PackedDataset
+        store = PackedDataset(args.packed)
+        paths, labels, classes = store.paths, store.labels, store.classes
+        embeddings = np.concatenate([embed(store.slice(i, min(i + args.batch_size, len(paths))), model)
+                                     for i in range(0, len(paths), args.batch_size)])
+    else:
+        from batch_scorer import list_inputs, load_classes
+        classes = load_classes()
+        paths, labels = list_inputs([args.source], classes)
+        embeddings = embed(paths, model, args.batch_size)
+    print(f'embedded {len(paths)} images ({embeddings.shape[1]} dimensions) in {time.perf_counter() - start:.1f} s')
+
+    build(embeddings, paths, labels, classes, args.output, inference.model_version(args.model, url=None), args.lists)
+    index = SimilarityIndex(args.output)
+    recall, ms = evaluate(index)
+    print(f'{len(index.offsets) - 1} lists written to {args.output}: recall@5 {recall:.3f}, {ms:.2f} ms per query')
+
+
+if __name__ == '__main__':
+    main()
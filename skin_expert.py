@@ -0,0 +1,137 @@
+# Retrieval for the Skin Expert chat.
+#
+# The condition descriptions and treatment texts in conditions.py are split
+# into sentence passages and indexed once with BM25 (an inverted index of
+# term -> (passage ids, term counts)). A question is answered with the best
+# passages, grouped by condition. When the question does not name a
+# condition, the last condition detected in the session is used as context.
+import math
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from conditions import class_names, disease_descriptions, remedies
+
+STOP_WORDS = frozenset('''
+a about also an and any are as at be been but by can could describe do does
+explain for from has have how i if in into is it its me my of on or other so
+such tell than that the their them then there these they this to was what when
+where which who why will with would you your
+'''.split())
+
+# Words in condition names that say nothing about which condition is meant
+GENERIC_NAME_WORDS = frozenset(['pictures', 'related', 'diseases', 'infections', 'lesions', 'like', 'benign', 'tumors'])
+
+FALLBACK = ("I couldn't find anything about that in my notes. I can answer questions about the ten conditions "
+            "the Detection tab recognises: what they are, how they are treated and whether they are contagious. "
+            "Please consult a dermatologist for anything else.")
+
+
+# Strip common inflections so 'treated', 'treating' and 'treatments' match
+def stem(token):
+    for suffix in ('ments', 'ment', 'ing', 'ed', 's'):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 4:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text):
+    return [stem(t) for t in re.findall(r'[a-z0-9]+', text.lower()) if t not in STOP_WORDS]
+
+
+# (condition, text) passages: the description, one sentence-level passage per
+# treatment sentence and whether the condition is contagious
+def passages():
+    result = []
+    for name in class_names:
+        result.append((name, disease_descriptions[name]))
+        for field in ('primary', 'secondary'):
+            for sentence in re.split(r'(?<=[.!?])\s+', remedies[name][field]):
+                if sentence:
+                    result.append((name, sentence))
+        contagious = 'is contagious' if remedies[name]['contagious'] else 'is not contagious'
+        result.append((name, f'{name} {contagious}.'))
+    return result
+
+
+class BM25Index:
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+        # the first passage of each condition is its description, which does
+        # not repeat the name, so the name is indexed with it
+        self.descriptions = {}
+        for i, (name, _) in enumerate(documents):
+            self.descriptions.setdefault(name, i)
+        postings = defaultdict(list)
+        lengths = []
+        for i, (name, text) in enumerate(documents):
+            tokens = tokenize(f'{name} {text}' if self.descriptions[name] == i else text)
+            lengths.append(len(tokens))
+            for term, count in Counter(tokens).items():
+                postings[term].append((i, count))
+        self.lengths = np.array(lengths, dtype=np.float32)
+        self.conditions = np.array([name for name, _ in documents])
+        self.average_length = float(self.lengths.mean())
+        self.postings = {}
+        for term, entries in postings.items():
+            ids, counts = zip(*entries)
+            idf = math.log(1 + (len(documents) - len(ids) + 0.5) / (len(ids) + 0.5))
+            self.postings[term] = (np.array(ids), np.array(counts, dtype=np.float32), idf)
+        # the words of each condition name, to tell which one a question is about
+        self.condition_terms = {name: set(tokenize(name)) - GENERIC_NAME_WORDS for name in class_names}
+        self.name_terms = set(tokenize(' '.join(class_names)))
+
+    # BM25 score of every document for query, accumulated term by term
+    def scores(self, query):
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * self.lengths / self.average_length)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            ids, counts, idf = self.postings[term]
+            scores[ids] += idf * counts * (self.k1 + 1) / (counts + norm[ids])
+        return scores
+
+    # Conditions whose name shares a word with the question
+    def mentioned(self, question):
+        terms = set(tokenize(question))
+        return [name for name, words in self.condition_terms.items() if terms & words]
+
+    # [(condition, text)] of the k best passages. Only passages about the
+    # conditions the question names are considered or, when it names none,
+    # about condition (the session's last detection) if any of them match.
+    def search(self, question, k=3, condition=None):
+        mentioned = self.mentioned(question)
+        # a question made only of condition names ('What is eczema?') asks
+        # what they are
+        if mentioned and set(tokenize(question)) <= self.name_terms:
+            return [self.documents[self.descriptions[name]] for name in mentioned][:k]
+        scores = self.scores(question)
+        focus = mentioned or ([condition] if condition else [])
+        if focus:
+            focused = scores * np.isin(self.conditions, focus)
+            if focused.max() > 0:
+                scores = focused
+        best = [i for i in np.argsort(-scores)[:k] if scores[i] > 0]
+        return [self.documents[i] for i in best]
+
+
+# Markdown answer built from the best passages, grouped by condition
+def answer(index, question, condition=None, k=3):
+    found = index.search(question, k, condition)
+    if not found:
+        return FALLBACK
+    grouped = defaultdict(list)
+    for name, text in found:
+        grouped[name].append(text)
+    parts = [f"**{name}**: {' '.join(texts)}" for name, texts in grouped.items()]
+    return '\n\n'.join(parts) + '\n\nFor advice about your own skin, please see a dermatologist.'
+
+
+# Yield text a word at a time, for st.write_stream
+def stream(text):
+    for token in re.findall(r'\S+\s*', text):
+        yield token
@@ -0,0 +1,278 @@
+# Scriptable training run for skin.h5, replacing the notebook's model.fit with
+# the LRA callback.
+#
+# The model, split, balanced stream and learning-rate policy are the
+# notebook's. Train and validation steps are XLA-compiled tf.functions, with
+# optional mixed float16 precision. The best weights are kept in variables
+# allocated once next to the model and updated with assign, so no epoch copies
+# the model to host memory. The model, optimizer, best weights, schedule and
+# running epoch metrics are checkpointed every --checkpoint-steps steps and at
+# the end of every epoch, so a preempted run started again with the same
+# --checkpoint-dir continues where it stopped. Each epoch prints its wall time
+# and training samples per second and appends them to history.csv in the
+# checkpoint directory.
+#
+#   python train.py path/to/IMG_CLASSES --output skin.h5 --checkpoint-dir checkpoints --mixed-precision
+import argparse
+import csv
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from preprocessing import IMAGE_SIZE
+from training_data import make_datasets, preprocess, trim
+
+HISTORY_FIELDS = ['epoch', 'loss', 'accuracy', 'val_loss', 'val_accuracy', 'learning_rate', 'next_learning_rate',
+                  'monitor', 'seconds', 'samples_per_second']
+
+
+# The notebook's EfficientNet-B2 classifier. The softmax stays float32 under
+# mixed precision.
+def build_model(classes, weights='imagenet'):
+    regularizers = tf.keras.regularizers
+    base = tf.keras.applications.EfficientNetB2(include_top=False, weights=weights,
+                                                input_shape=(IMAGE_SIZE[1], IMAGE_SIZE[0], 3), pooling='max')
+    x = tf.keras.layers.BatchNormalization(axis=-1, momentum=0.99, epsilon=0.001)(base.output)
+    x = tf.keras.layers.Dense(256, kernel_regularizer=regularizers.l2(l=0.016), activity_regularizer=regularizers.l1(0.006),
+                              bias_regularizer=regularizers.l1(0.006), activation='relu')(x)
+    x = tf.keras.layers.Dropout(rate=.45, seed=123)(x)
+    outputs = tf.keras.layers.Dense(classes, activation='softmax', dtype='float32')(x)
+    return tf.keras.Model(inputs=base.input, outputs=outputs)
+
+
+# The LRA callback's policy without the prompt. Training accuracy is monitored
+# until it reaches threshold, validation loss after that. After patience
+# epochs without improvement the learning rate is multiplied by factor (and
+# with dwell the best weights are restored); training stops after
+# stop_patience reductions in a row without improvement. The state lives in
+# variables so it is checkpointed with the model.
+class Schedule(tf.Module):
+    def __init__(self, learning_rate, patience=1, stop_patience=3, threshold=0.9, factor=0.5, dwell=True):
+        super().__init__()
+        self.patience = patience
+        self.stop_patience = stop_patience
+        self.threshold = threshold
+        self.factor = factor
+        self.dwell = dwell
+        self.learning_rate = tf.Variable(learning_rate, dtype=tf.float32, trainable=False)
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.step = tf.Variable(0, dtype=tf.int64, trainable=False)  # steps done in the current epoch
+        self.count = tf.Variable(0, trainable=False)
+        self.stop_count = tf.Variable(0, trainable=False)
+        self.highest_accuracy = tf.Variable(0.0, trainable=False)
+        self.lowest_loss = tf.Variable(np.inf, dtype=tf.float32, trainable=False)
+        self.best_epoch = tf.Variable(0, trainable=False)
+        self.stopped = tf.Variable(False, trainable=False)
+
+    # Record an epoch's results. Returns the monitored metric, whether it
+    # improved and whether the learning rate was reduced.
+    def update(self, accuracy, val_loss):
+        monitor = 'accuracy' if accuracy < self.threshold else 'val_loss'
+        if monitor == 'accuracy':
+            improved = accuracy > float(self.highest_accuracy)
+        else:
+            improved = val_loss < float(self.lowest_loss)
+        reduced = False
+        if improved:
+            self.count.assign(0)
+            self.stop_count.assign(0)
+            self.best_epoch.assign(int(self.epoch) + 1)
+        elif int(self.count) >= self.patience - 1:
+            self.learning_rate.assign(self.learning_rate * self.factor)
+            self.count.assign(0)
+            self.stop_count.assign_add(1)
+            reduced = True
+        else:
+            self.count.assign_add(1)
+        self.highest_accuracy.assign(max(float(self.highest_accuracy), accuracy))
+        if improved or monitor == 'val_loss' or (reduced and not self.dwell):
+            self.lowest_loss.assign(min(float(self.lowest_loss), val_loss))
+        self.stopped.assign(int(self.stop_count) >= self.stop_patience)
+        return monitor, improved, reduced
+
+
+class Trainer:
+    def __init__(self, model, optimizer, schedule, mixed_precision=False, jit_compile=True):
+        self.model = model
+        self.optimizer = optimizer
+        self.schedule = schedule
+        self.mixed_precision = mixed_precision
+        self.loss = tf.keras.losses.CategoricalCrossentropy()
+        self.train_loss = tf.keras.metrics.Mean()
+        self.train_accuracy = tf.keras.metrics.CategoricalAccuracy()
+        self.valid_loss = tf.keras.metrics.Mean()
+        self.valid_accuracy = tf.keras.metrics.CategoricalAccuracy()
+        optimizer.build(model.trainable_variables)
+        # one shadow per model variable, including the batch norm statistics
+        self.best = [tf.Variable(v.value(), trainable=False) for v in model.weights]
+        self.train_step = tf.function(self._train_step, jit_compile=jit_compile)
+        self.test_step = tf.function(self._test_step, jit_compile=jit_compile)
+        self.save_best = tf.function(lambda: self._copy(self.best, model.weights))
+        self.restore_best = tf.function(lambda: self._copy(model.weights, self.best))
+
+    @staticmethod
+    def _copy(targets, sources):
+        for target, source in zip(targets, sources):
+            target.assign(source)
+
+    def _train_step(self, images, labels):
+        with tf.GradientTape() as tape:
+            predictions = self.model(images, training=True)
+            loss = self.loss(labels, predictions) + sum(tf.cast(l, tf.float32) for l in self.model.losses)
+            scaled = self.optimizer.get_scaled_loss(loss) if self.mixed_precision else loss
+        gradients = tape.gradient(scaled, self.model.trainable_variables)
+        if self.mixed_precision:
+            gradients = self.optimizer.get_unscaled_gradients(gradients)
+        self.optimizer.apply_gradients(zip(gradients, self.model.trainable_variables))
+        self.train_loss.update_state(loss)
+        self.train_accuracy.update_state(labels, predictions)
+
+    def _test_step(self, images, labels, weights):
+        predictions = self.model(images, training=False)
+        self.valid_loss.update_state(tf.keras.losses.categorical_crossentropy(labels, predictions), weights)
+        self.valid_accuracy.update_state(labels, predictions, weights)
+
+    def checkpoint(self):
+        return tf.train.Checkpoint(model=self.model, optimizer=self.optimizer, schedule=self.schedule, best=self.best,
+                                   train_loss=self.train_loss, train_accuracy=self.train_accuracy)
+
+    # Loss and accuracy over dataset. A short last batch is padded to the size
+    # of the first with zero-weight rows, so the compiled step sees one shape
+    # and is not compiled again for the remainder.
+    def evaluate(self, dataset):
+        self.valid_loss.reset_state()
+        self.valid_accuracy.reset_state()
+        size = None
+        for images, labels in dataset:
+            count = int(tf.shape(labels)[0])
+            size = size or count
+            weights = tf.ones([count])
+            if count < size:
+                images = tf.pad(images, [[0, size - count], [0, 0], [0, 0], [0, 0]])
+                labels = tf.pad(labels, [[0, size - count], [0, 0]])
+                weights = tf.pad(weights, [[0, size - count]])
+            self.test_step(images, labels, weights)
+        return float(self.valid_loss.result()), float(self.valid_accuracy.result())
+
+
+def append_history(path, row):
+    new = not os.path.exists(path)
+    with open(path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=HISTORY_FIELDS)
+        if new:
+            writer.writeheader()
+        writer.writerow(row)
+
+
+# Train until epochs or the schedule stops, checkpointing into manager.
+# Resumes from the latest checkpoint when there is one.
+def fit(trainer, manager, train, valid, epochs, steps, batch_size, checkpoint_steps=0, history=None):
+    schedule = trainer.schedule
+    if manager.latest_checkpoint:
+        manager.checkpoint.restore(manager.latest_checkpoint).assert_existing_objects_matched()
+        print(f'resumed from {manager.latest_checkpoint} at epoch {int(schedule.epoch) + 1}, step {int(schedule.step)}')
+    batches = iter(train.repeat())
+    print(f"{'epoch':>9s}{'loss':>9s}{'accuracy':>10s}{'v_loss':>9s}{'v_acc':>9s}{'lr':>10s}{'next lr':>10s}"
+          f"{'monitor':>10s}{'seconds':>9s}{'samples/s':>11s}")
+    while int(schedule.epoch) < epochs and not bool(schedule.stopped):
+        epoch = int(schedule.epoch)
+        learning_rate = float(schedule.learning_rate)
+        trainer.optimizer.learning_rate.assign(learning_rate)
+        first = int(schedule.step)
+        start = time.perf_counter()
+        for step in range(first, steps):
+            trainer.train_step(*next(batches))
+            schedule.step.assign(step + 1)
+            if checkpoint_steps and (step + 1) % checkpoint_steps == 0 and step + 1 < steps:
+                manager.save()
+            print(f'{epoch + 1:4d} step {step + 1}/{steps}  accuracy {float(trainer.train_accuracy.result()) * 100:6.2f}'
+                  f'  loss {float(trainer.train_loss.result()):.5f}', end='\r', flush=True)
+        train_seconds = time.perf_counter() - start
+        val_loss, val_accuracy = trainer.evaluate(valid)
+        seconds = time.perf_counter() - start
+        loss, accuracy = float(trainer.train_loss.result()), float(trainer.train_accuracy.result())
+
+        monitor, improved, reduced = schedule.update(accuracy, val_loss)
+        if improved:
+            trainer.save_best()
+        elif reduced and schedule.dwell:
+            trainer.restore_best()
+        row = {
+            'epoch': epoch + 1, 'loss': loss, 'accuracy': accuracy, 'val_loss': val_loss, 'val_accuracy': val_accuracy,
+            'learning_rate': learning_rate, 'next_learning_rate': float(schedule.learning_rate), 'monitor': monitor,
+            'seconds': seconds, 'samples_per_second': (steps - first) * batch_size / train_seconds,
+        }
+        print(f"{epoch + 1:4d}/{epochs:<4d}{loss:9.3f}{accuracy * 100:10.3f}{val_loss:9.5f}{val_accuracy * 100:9.3f}"
+              f"{learning_rate:10.6f}{row['next_learning_rate']:10.6f}{monitor:>10s}{seconds:9.1f}"
+              f"{row['samples_per_second']:11.1f}{'  *' if improved else ''}")
+        trainer.train_loss.reset_state()
+        trainer.train_accuracy.reset_state()
+        schedule.epoch.assign_add(1)
+        schedule.step.assign(0)
+        manager.save()
+        if history:
+            append_history(history, row)
+
+    if bool(schedule.stopped):
+        print(f'training halted after {schedule.stop_patience} learning rate reductions without improvement')
+    trainer.restore_best()
+    print(f'model set to the weights from epoch {int(schedule.best_epoch)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the skin disease classifier')
+    parser.add_argument('source', help='IMG_CLASSES directory with one folder per class')
+    parser.add_argument('--output', default='skin.h5')
+    parser.add_argument('--checkpoint-dir', default='checkpoints', help='resume from and write checkpoints here')
+    parser.add_argument('--checkpoint-steps', type=int, default=0, help='also checkpoint every this many steps')
+    parser.add_argument('--trsplit', type=float, default=0.8)
+    parser.add_argument('--vsplit', type=float, default=0.1)
+    parser.add_argument('--epochs', type=int, default=40)
+    parser.add_argument('--batch-size', type=int, default=30)
+    parser.add_argument('--samples-per-class', type=int, default=1006, help='per class and epoch, as max_samples in the notebook')
+    parser.add_argument('--learning-rate', type=float, default=0.001)
+    parser.add_argument('--patience', type=int, default=1, help='epochs without improvement before the learning rate is reduced')
+    parser.add_argument('--stop-patience', type=int, default=3, help='reductions without improvement before training stops')
+    parser.add_argument('--threshold', type=float, default=0.9, help='training accuracy at which validation loss is monitored')
+    parser.add_argument('--factor', type=float, default=0.5)
+    parser.add_argument('--no-dwell', action='store_true', help='keep the current weights when the learning rate is reduced')
+    parser.add_argument('--mixed-precision', action='store_true', help='compute in float16 with float32 weights')
+    parser.add_argument('--no-xla', action='store_true', help='run the steps without XLA compilation')
+    parser.add_argument('--cache-dir', default=None)
+    parser.add_argument('--weights', default='imagenet', help="base model initialisation ('imagenet' or 'none')")
+    args = parser.parse_args()
+
+    train_df, test_df, valid_df = preprocess(args.source, args.trsplit, args.vsplit)
+    train_df = trim(train_df, args.samples_per_class, 0, 'labels')
+    train, valid, test, classes, steps = make_datasets(train_df, valid_df, test_df, args.batch_size,
+                                                       cache_dir=args.cache_dir, samples_per_class=args.samples_per_class)
+
+    weights = None if args.weights == 'none' else args.weights
+    if args.mixed_precision:
+        tf.keras.mixed_precision.set_global_policy('mixed_float16')
+    model = build_model(len(classes), weights)
+    optimizer = tf.keras.optimizers.Adamax(learning_rate=args.learning_rate)
+    if args.mixed_precision:
+        optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+    schedule = Schedule(args.learning_rate, args.patience, args.stop_patience, args.threshold, args.factor, not args.no_dwell)
+    trainer = Trainer(model, optimizer, schedule, args.mixed_precision, jit_compile=not args.no_xla)
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+    manager = tf.train.CheckpointManager(trainer.checkpoint(), args.checkpoint_dir, max_to_keep=2)
+    fit(trainer, manager, train, valid, args.epochs, steps, args.batch_size, args.checkpoint_steps,
+        history=os.path.join(args.checkpoint_dir, 'history.csv'))
+
+    _, accuracy = trainer.evaluate(test)
+    print(f'accuracy on the test set is {accuracy * 100:5.2f} %')
+    if args.mixed_precision:
+        # save a float32 copy so the app and batch scorer load the usual model
+        tf.keras.mixed_precision.set_global_policy('float32')
+        trained, model = model, build_model(len(classes), weights=None)
+        model.set_weights(trained.get_weights())
+    model.save(args.output)
+    print(f'model saved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
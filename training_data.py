@@ -0,0 +1,154 @@
+# tf.data input pipelines for training, built from the train_df / valid_df /
+# test_df frames that the notebook's preprocess(sdir, trsplit, vsplit) returns.
+#
+# JPEG decode and resize run in parallel inside the TensorFlow runtime, the
+# decoded uint8 images are cached (in memory or to a local file) during the
+# first epoch, horizontal flips are applied to whole batches at once and the
+# next batches are prefetched while the model trains on the current one.
+#
+# Class balancing happens in the stream: every class is drawn with equal
+# probability and augmented on the fly, so no augmented copies are written.
+import math
+import os
+
+import pandas as pd
+import tensorflow as tf
+
+from preprocessing import IMAGE_SIZE
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+
+# Class names in the order flow_from_dataframe assigns class_indices
+def class_list(df, column='labels'):
+    return sorted(df[column].unique())
+
+
+# Walk sdir (one folder per class) and split it into stratified train, test
+# and valid frames with 'filepaths' and 'labels' columns
+def preprocess(sdir, trsplit, vsplit):
+    from sklearn.model_selection import train_test_split
+    filepaths = []
+    labels = []
+    for klass in os.listdir(sdir):
+        classpath = os.path.join(sdir, klass)
+        for f in os.listdir(classpath):
+            filepaths.append(os.path.join(classpath, f))
+            labels.append(klass)
+    df = pd.DataFrame({'filepaths': filepaths, 'labels': labels})
+    dsplit = vsplit / (1 - trsplit)
+    train_df, dummy_df = train_test_split(df, train_size=trsplit, shuffle=True, random_state=123, stratify=df['labels'])
+    valid_df, test_df = train_test_split(dummy_df, train_size=dsplit, shuffle=True, random_state=123, stratify=dummy_df['labels'])
+    print('train_df length: ', len(train_df), '  test_df length: ', len(test_df), '  valid_df length: ', len(valid_df))
+    print(train_df['labels'].value_counts())
+    return train_df, test_df, valid_df
+
+
+# Limit every class to at most max_size randomly chosen rows and drop classes
+# with fewer than min_size rows
+def trim(df, max_size, min_size, column):
+    counts = df[column].value_counts()
+    df = df[df[column].isin(counts[counts >= min_size].index)]
+    df = df.groupby(column, group_keys=False).sample(frac=1.0, random_state=123).groupby(column).head(max_size)
+    print(list(df[column].value_counts()))
+    return df.reset_index(drop=True)
+
+
+# Read, decode and resize one image to a uint8 (height, width, 3) tensor.
+# Like flow_from_dataframe the image is resized without cropping, but with
+# antialiased bilinear filtering rather than nearest neighbour.
+def load_image(path, image_size=IMAGE_SIZE):
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    image = tf.image.resize(image, (image_size[1], image_size[0]), antialias=True)
+    return tf.saturate_cast(tf.round(image), tf.uint8)
+
+
+# Flip a random half of a (batch, height, width, 3) tensor left to right
+def random_flip(images):
+    flip = tf.random.uniform([tf.shape(images)[0], 1, 1, 1]) < 0.5
+    return tf.where(flip, tf.reverse(images, axis=[2]), images)
+
+
+# The augmentations balance() used to write to disk (flip, 20 degree
+# rotation, 20 % shift and zoom), applied to float batches
+def augmenter(seed=123):
+    return tf.keras.Sequential([
+        tf.keras.layers.RandomFlip('horizontal', seed=seed),
+        tf.keras.layers.RandomRotation(20 / 360, fill_mode='nearest', seed=seed),
+        tf.keras.layers.RandomTranslation(0.2, 0.2, fill_mode='nearest', seed=seed),
+        tf.keras.layers.RandomZoom(0.2, fill_mode='nearest', seed=seed),
+    ])
+
+
+# Batches of (float32 images in 0-255, one-hot labels). EfficientNet rescales
+# internally, so pixels are not normalised here.
+#   training  shuffle every epoch and apply random horizontal flips
+#   cache     None for no caching, '' to cache in memory, or a file path
+def make_dataset(df, classes, batch_size, training=False, cache=None, image_size=IMAGE_SIZE,
+                 x_col='filepaths', y_col='labels', shuffle_buffer=1024, seed=123):
+    class_index = {name: i for i, name in enumerate(classes)}
+    labels = df[y_col].map(class_index).to_numpy()
+    dataset = tf.data.Dataset.from_tensor_slices((df[x_col].to_numpy(), labels))
+    dataset = dataset.map(lambda path, label: (load_image(path, image_size), label),
+                          num_parallel_calls=AUTOTUNE, deterministic=not training)
+    if cache is not None:
+        dataset = dataset.cache(cache)
+    if training:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+    if training:
+        dataset = dataset.map(lambda images, labels: (random_flip(images), labels), num_parallel_calls=AUTOTUNE)
+    dataset = dataset.map(lambda images, labels: (tf.cast(images, tf.float32), tf.one_hot(labels, len(classes))),
+                          num_parallel_calls=AUTOTUNE)
+    return dataset.prefetch(AUTOTUNE)
+
+
+# Endless class-balanced training stream. Each class is decoded (and cached)
+# on its own, repeated and reshuffled, and sample_from_datasets draws from all
+# classes with equal weight; batches are augmented on the fly. Returns the
+# dataset and the number of steps in an epoch of samples_per_class images
+# per class.
+def make_balanced_dataset(df, classes, batch_size, samples_per_class, cache_dir=None, image_size=IMAGE_SIZE,
+                          x_col='filepaths', y_col='labels', shuffle_buffer=1024, seed=123):
+    streams = []
+    for i, name in enumerate(classes):
+        paths = df.loc[df[y_col] == name, x_col].to_numpy()
+        stream = tf.data.Dataset.from_tensor_slices(paths)
+        stream = stream.map(lambda path: load_image(path, image_size), num_parallel_calls=AUTOTUNE, deterministic=False)
+        stream = stream.cache('' if cache_dir is None else tf.io.gfile.join(cache_dir, f'train_{i}'))
+        stream = stream.shuffle(min(shuffle_buffer, len(paths)), seed=seed + i, reshuffle_each_iteration=True).repeat()
+        streams.append(stream.map(lambda image, label=i: (image, label)))
+
+    augment = augmenter(seed)
+    dataset = tf.data.Dataset.sample_from_datasets(streams, weights=[1.0 / len(classes)] * len(classes), seed=seed)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(lambda images, labels: (augment(tf.cast(images, tf.float32), training=True),
+                                                  tf.one_hot(labels, len(classes))),
+                          num_parallel_calls=AUTOTUNE)
+    steps = math.ceil(len(classes) * samples_per_class / batch_size)
+    return dataset.prefetch(AUTOTUNE), steps
+
+
+# Train, validation and test datasets plus the class list. With cache_dir set
+# each split is cached to a file there after its first pass (delete the
+# directory when the split changes); otherwise decoded images stay in memory.
+# With samples_per_class set the training split is the balanced stream above.
+# Returns train, valid, test, classes and the number of training steps per epoch.
+def make_datasets(train_df, valid_df, test_df, batch_size, test_batch_size=None, cache_dir=None,
+                  image_size=IMAGE_SIZE, samples_per_class=None):
+    classes = class_list(train_df)
+
+    def cache(name):
+        return '' if cache_dir is None else tf.io.gfile.join(cache_dir, name)
+
+    if cache_dir is not None:
+        tf.io.gfile.makedirs(cache_dir)
+    if samples_per_class:
+        train, train_steps = make_balanced_dataset(train_df, classes, batch_size, samples_per_class,
+                                                   cache_dir=cache_dir, image_size=image_size)
+    else:
+        train = make_dataset(train_df, classes, batch_size, training=True, cache=cache('train'), image_size=image_size)
+        train_steps = math.ceil(len(train_df) / batch_size)
+    valid = make_dataset(valid_df, classes, batch_size, cache=cache('valid'), image_size=image_size)
+    test = make_dataset(test_df, classes, test_batch_size or batch_size, cache=cache('test'), image_size=image_size)
+    return train, valid, test, classes, train_steps